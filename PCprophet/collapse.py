@@ -7,6 +7,8 @@ import networkx as nx
 
 import PCprophet.io_ as io
 import PCprophet.go_fdr as go_fdr
+import PCprophet.normalize as normalize
+import PCprophet.perf as perf
 from PCprophet.exceptions import NotImplementedError
 
 
@@ -22,11 +24,11 @@ class ProphetExperiment(object):
       feature: mp_feat_norm.txt
       peaks: list of peaks and selected peak per complex
       pred: prediction from predict.py
-      prot_matrix: resampled protein matrix <- not rescaled
+      prot_matrix: normalized protein profiles (io.ProfileStore)
       annotation: name
       base: path
       mw: mw from uniprot
-      raw: raw rescaled to 72 protein matrix
+      raw: raw resampled to 72 protein profiles (io.ProfileStore)
       cal: calibration file generated from collapse.calc_calibration
 
     Raises:
@@ -47,12 +49,16 @@ class ProphetExperiment(object):
         cal=None,
     ):
         super(ProphetExperiment, self).__init__()
-        self.feature = pd.read_csv(feature, sep="\t", index_col="ID")
-        self.peaks = pd.read_csv(peaks, sep="\t", index_col="MB", error_bad_lines=False)
-        self.pred = pd.read_csv(pred, sep="\t", index_col="ID")
-        self.prot_matrix = pd.read_csv(prot_matrix, sep="\t", index_col="ID")
-        self.raw = pd.read_csv(raw, sep="\t", index_col="ID")
-        self.annotation = pd.read_csv(annotation, sep="\t", index_col="ID")
+        self.feature = io.read_table(feature, index_col="ID")
+        self.peaks = io.read_table(peaks, index_col="MB", error_bad_lines=False)
+        self.pred = io.read_table(pred, index_col="ID")
+        self.prot_matrix = prot_matrix.load().to_df()
+        # flat profiles have no intensity
+        self.prot_matrix = self.prot_matrix.loc[(self.prot_matrix != 0).any(axis=1)]
+        self.raw = raw.load().to_df()
+        self.annotation = io.read_table(
+            annotation, index_col="ID", usecols=["ID", "ANN", "CMPLT"]
+        )
         self.base = base
         self.condition = nm
         self.mw = mw
@@ -70,7 +76,7 @@ class ProphetExperiment(object):
         )
         self.complex_c["CREP"] = self.condition
         torm = ["COR", "DIF", "NEG", "SHFT", "W"]
-        self.complex_c.drop(torm, inplace=True, axis=1)
+        self.complex_c.drop(torm, inplace=True, axis=1, errors="ignore")
         self.complex_c["ANN"] = self.annotation["ANN"]
         self.complex_c["CMPLT"] = self.annotation["CMPLT"]
 
@@ -371,14 +377,11 @@ class MultiExperiment(object):
         """
         explode the rows of the every experiment into all proteins
         """
-        self.complex_c_all["MB"] = self.complex_c_all["MB"].str.split("#")
-        self.protein_c = io.explode(df=self.complex_c_all, lst_cols=["MB"])
         # nm holds the old cmplx name before multi_collapse
-        old2new_id = dict(zip(self.protein_c["nm"], self.protein_c["ID"]))
+        old2new_id = dict(zip(self.complex_c_all["nm"], self.complex_c_all["ID"]))
         old2new_id = {k.split("$")[0]: v for k, v in old2new_id.items()}
-        self.protein_c.drop(
-            ["nm", "IS_CMPLX", "SC_CC", "SC_BP", "SC_MF"], inplace=True, axis=1
-        )
+        torm = ["nm", "IS_CMPLX", "SC_CC", "SC_BP", "SC_MF"]
+        self.protein_c = io.explode_members(self.complex_c_all.drop(torm, axis=1), "MB")
         self.protein_c[["COND", "REPL"]] = self.protein_c.CREP.str.split(
             "_", expand=True
         )
@@ -448,13 +451,13 @@ def calc_calibration(calpath):
     cal_d = dict(zip(xnew, f(xnew)))
     cal_d = {k: round(10 ** v, 2) for k, v in cal_d.items()}
     calout = "cal.txt"
-    io.create_file(calout, ["FR", "MW"])
     k = smart_rename({str(x): str(v) for x, v in cal_d.items()})
-    [io.dump_file(calout, "\t".join([x, k[x]])) for x in list(k.keys())]
+    with io.BatchWriter(calout, ["FR", "MW"]) as out:
+        out.dump_all(["\t".join([x, k[x]]) for x in list(k.keys())])
     return cal_d
 
 
-def runner(tmp_, ids, cal, mw, fdr, mode):
+def runner(tmp_, ids, cal, mw, fdr, mode, compress="False"):
     """
     read folder tmp in directory.
     then loop for each file and create a combined file which contains all files
@@ -477,13 +480,12 @@ def runner(tmp_, ids, cal, mw, fdr, mode):
         if not exp_info.get(base, None):
             continue
         print(base, exp_info[base])
-        mp_feat_norm = os.path.join(smpl, "mp_feat_norm.txt")
-        pred_out = os.path.join(smpl, "rf.txt")
-        ann = os.path.join(smpl, "cmplx_combined.txt")
+        mp_feat_norm = io.tmp_file(smpl, "mp_feat_norm")
+        pred_out = io.tmp_file(smpl, "rf")
+        ann = io.tmp_file(smpl, "cmplx_combined")
         # NB this needed for stoichiometry estimation
-        prot = os.path.join(smpl, "transf_matrix.txt")
-        raw = os.path.join(smpl, "raw.txt")
-        peak = os.path.join(smpl, "peak_list.txt")
+        prot, raw = normalize.get_stores(smpl)
+        peak = io.tmp_file(smpl, "peak_list")
         exp = ProphetExperiment(
             feature=mp_feat_norm,
             peaks=peak,
@@ -505,6 +507,7 @@ def runner(tmp_, ids, cal, mw, fdr, mode):
     allexps.multi_collapse()
     allexps.combine_all()
     final = allexps.protein_centric_combine()
-    outname = os.path.join(tmp_, "combined.txt")
-    final.to_csv(outname, sep="\t", index=False)
+    perf.count(complexes_in=allexps.complex_c_all.shape[0], rows_out=final.shape[0])
+    outname = io.tmp_file(tmp_, "combined", io.tmp_format("txt", compress))
+    io.write_table(final, outname)
     return True
@@ -12,8 +12,10 @@ import scipy.stats as sta
 
 
 import PCprophet.io_ as io
+import PCprophet.perf as perf
 import PCprophet.stats_ as st
 import PCprophet.parse_go as go_parser
+import PCprophet.resource_cache as cache
 
 
 # datatype which we use for mapping protein ids to a corresponding
@@ -475,7 +477,7 @@ def differential_(fl, mode, ids):
     performs differential analysis using first raw profiles (i.e abu)
     and then by using the normalized (asm state)
     """
-    df = pd.read_csv(fl, sep="\t")
+    df = io.read_csv(fl, sep="\t")
     if mode == "abu":
         combined, vals = extract_inte(df, mode, norm=False)
     elif mode == "asm":
@@ -567,7 +569,7 @@ def calc_stoic(path, tmp_fold):
     header = []
     cmplx_stoi = io.makedeephash()
     temp = {}
-    for line in open(path, "r"):
+    for line in io.open_file(path):
         line = line.rstrip("\n")
         if line.startswith(str("ID") + "\t"):
             header = re.split(r"\t+", line)
@@ -587,11 +589,13 @@ def calc_stoic(path, tmp_fold):
         tmp.extend([mp + "\t" + x for x in reformat_cmplx_hoh(cmplx_stoi[mp])])
     header = ["CMPLX", "COND", "MB", "RATIO", "NR"]
     stoi_path = os.path.join(tmp_fold, "stoichiometry.txt")
-    io.create_file(stoi_path, header)
-    [io.dump_file(stoi_path, x) for x in tmp]
+    with io.BatchWriter(stoi_path, header) as out:
+        out.dump_all(tmp)
 
 
-def create_complex_report(infile, sto, sid, outfile="ComplexReport.txt"):
+def create_complex_report(
+    infile, sto, sid, outfile="ComplexReport.txt", sp_go="tmp_GO_sp_only.txt"
+):
     def rescale_fr(x, fr):
         try:
             return str(round(x["SEL"] * fr[x["COND"]] / 72))
@@ -601,7 +605,8 @@ def create_complex_report(infile, sto, sid, outfile="ComplexReport.txt"):
     print("Creating complex level report\n")
     sto = pd.read_csv(sto, sep="\t")
     info = pd.read_csv(sid, sep="\t")
-    combined = pd.read_csv(infile, sep="\t")
+    combined = io.read_csv(infile, sep="\t")
+    perf.count(rows_in=combined.shape[0])
     # drop single protein now
     combined = combined[combined["P"] != -1]
     cal = None
@@ -654,9 +659,9 @@ def create_complex_report(infile, sto, sid, outfile="ComplexReport.txt"):
     mrg[["Completness"]] = mrg[["Completness"]].fillna(value=0)
 
     # add GO terms
-    go = pd.read_csv(io.resource_path("go_terms_class.txt"), sep="\t")
+    go = cache.table(io.resource_path("go_terms_class.txt"))
     id2name = dict(zip(go["id"], go["names"]))
-    gaf = go_parser.read_gaf_out(io.resource_path("tmp_GO_sp_only.txt"))
+    gaf = cache.gaf(io.resource_path(sp_go))
 
     def go_name(gn, gaf, id2name):
         """
@@ -665,9 +670,10 @@ def create_complex_report(infile, sto, sid, outfile="ComplexReport.txt"):
         # cc, mf, bp = set(), set(), set()
         nm = {"CC": set(), "MF": set(), "BP": set()}
         for g in gn.split(":"):
-            for onto in gaf[g]:
+            terms = gaf.get(g, {})
+            for onto in terms:
                 if onto in ["CC", "MF", "BP"]:
-                    {nm[onto].add(x) for x in gaf[g][onto].split(";")}
+                    {nm[onto].add(x) for x in terms[onto].split(";")}
         cc = ";".join([id2name.get(x, x) for x in nm["CC"] if "GO" in x])
         mf = ";".join([id2name.get(x, x) for x in nm["MF"] if "GO" in x])
         bp = ";".join([id2name.get(x, x) for x in nm["BP"] if "GO" in x])
@@ -688,6 +694,7 @@ def create_complex_report(infile, sto, sid, outfile="ComplexReport.txt"):
     mrg["Common GO Cellular Component"] = cc
     mrg["Common GO Biological Process"] = bp
     mrg["Common GO Molecular Function"] = mf
+    perf.count(complexes_out=mrg.shape[0])
     mrg.to_csv(outfile, sep="\t", index=False)
 
 
@@ -725,6 +732,7 @@ def create_ppi_report(infile="ComplexReport.txt", outfile="PPIReport.txt"):
         "Replicate",
         "Reported",
     ]
+    perf.count(pairs=len(outf))
     io.wrout(outf, outfile, header)
 
 
@@ -739,8 +747,9 @@ def assembled(df, thr=0.3):
         return "Negative"
 
 
-def runner(infile, sample, outf, temp):
+def runner(infile, sample, outf, temp, sp_go="tmp_GO_sp_only.txt"):
     """
+    sp_go = gaf derived file used for the GO terms of the complex report
     """
     if not os.path.isdir(outf):
         os.makedirs(outf)
@@ -748,7 +757,7 @@ def runner(infile, sample, outf, temp):
     calc_stoic(path=infile, tmp_fold=temp)
     sto = os.path.join(temp, "stoichiometry.txt")
     complex_report_out = os.path.join(outf, "ComplexReport.txt")
-    create_complex_report(infile, sto, sample, outfile=complex_report_out)
+    create_complex_report(infile, sto, sample, outfile=complex_report_out, sp_go=sp_go)
     ppi_report_out = os.path.join(outf, "PPIReport.txt")
     create_ppi_report(infile=complex_report_out, outfile=ppi_report_out)
     if len(list(ids.keys())) == 1:
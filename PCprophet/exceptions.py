@@ -38,6 +38,12 @@ class NaInMatrixError(Exception):
         self.dErrorArguments = dErrorArguements
 
 
+class SampleError(Exception):
+    def __init__(self, failed):
+        Exception.__init__(self, "Preprocessing failed for {0}".format(failed))
+        self.failed = failed
+
+
 class NotImplementedError(Exception):
     def __init___(self, dErrorArguments):
         Exception.__init__(self, "Not implemented error")
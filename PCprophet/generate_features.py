@@ -1,6 +1,7 @@
 import re
 import sys
 import os
+import multiprocessing as mult_proc
 import numpy as np
 import scipy.signal as signal
 import pandas as pd
@@ -8,6 +9,8 @@ from scipy.ndimage import uniform_filter
 
 import PCprophet.parse_go as go
 import PCprophet.io_ as io
+import PCprophet.perf as perf
+import PCprophet.resource_cache as cache
 import PCprophet.stats_ as st
 
 
@@ -26,7 +29,7 @@ class ProteinProfile(object):
     def __init__(self, acc, inten):
         super(ProteinProfile, self).__init__()
         self.acc = acc
-        self.inten = np.array([float(x) for x in inten])
+        self.inten = np.asarray(inten, dtype=float)
         self.peaks = []
 
     def get_inte(self):
@@ -193,21 +196,20 @@ class ComplexProfile(object):
     def create_row(self):
         """
         get all outputs and create a row
+        cor and dif are kept as arrays and formatted by the writer
         """
-        dif_conc = ",".join([str(x) for x in self.diff])
-        cor_conc = ",".join([str(x) for x in self.cor])
         row_id = self.get_name()
         members = self.format_ids()
         row = [
             row_id,
             members,
-            cor_conc,
-            str(self.shifts),
-            dif_conc,
-            str(self.width),
-            self.score,
+            self.cor,
+            self.shifts,
+            self.diff,
+            self.width,
         ]
-        return "\t".join([str(x) for x in row])
+        row.extend([float(x) for x in self.score.split("\t")])
+        return row
 
 
 def add_top(result, item):
@@ -305,18 +307,22 @@ def alligner(aoa):
             return pks
 
 
-def format_hash(temp):
+def format_hash(temp, store=None):
     """
     get a row hash and create a ComplexProfile object
+    profiles are taken from the FT column or from a io.ProfileStore
     """
-    inten = temp["FT"].split("#")
     members = temp["MB"].split("#")
+    if store is None:
+        inten = io.parse_profiles(temp["FT"])
+    else:
+        inten = [store.get(x) for x in members]
     tmp = ComplexProfile(temp["ID"])
     for idx, acc in enumerate(members):
         if acc in tmp.get_members():
             continue
         # peak picking already here
-        protein = ProteinProfile(acc, inten[idx].split(","))
+        protein = ProteinProfile(acc, inten[idx])
         protein.calc_peaks()
         tmp.add_member(protein)
     return tmp
@@ -335,8 +341,48 @@ def gen_feat(cmplx, goobj, gaf):
         return None, None
 
 
+# resources of the feature workers, set once per process by init_worker
+_WORKER = {}
+
+
+def init_worker(goobj, gaf, store):
+    _WORKER.update({"goobj": goobj, "gaf": gaf, "store": store})
+
+
+def feat_chunk(records):
+    """
+    generate features for a chunk of complexes
+    returns the feature rows, the peak rows and the number of pairs
+    """
+    feat_file = []
+    peaks_file = []
+    pairs = 0
+    goobj, gaf, store = _WORKER["goobj"], _WORKER["gaf"], _WORKER["store"]
+    for temp in records:
+        cmplx = format_hash(temp, store)
+        feat_row, peaks = gen_feat(cmplx, goobj, gaf)
+        if feat_row and peaks:
+            feat_file.append(feat_row)
+            [peaks_file.append(x.split("\t")) for x in list(peaks)]
+            n = len(cmplx.get_members())
+            pairs += n * (n - 1) // 2
+    return feat_file, peaks_file, pairs
+
+
+def get_workers(workers, nchunks):
+    """
+    number of feature processes, a sample already running in a daemonic
+    process cannot start its own
+    """
+    if mult_proc.current_process().daemon:
+        return 1
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, nchunks))
+
+
 # wrapper
-def mp_cmplx(filename, goobj, gaf):
+def mp_cmplx(filename, goobj, gaf, workers=1, chunk=500):
     """
     map complex into 3 vector => cor vectors
     shift peak
@@ -345,41 +391,54 @@ def mp_cmplx(filename, goobj, gaf):
     cor(A[idx:(idx + w)], B[idx:(idx+w)])
     width = fwhm(A[idx-q:idx+q])
     so q should be 1/2 of w ?
+    complexes are scored in chunks of chunk rows by workers processes,
+    rows are returned in the input order
     """
-    things, header = [], []
-    temp = {}
-    feat_file = []
-    peaks_file = []
     print("calculating features for " + filename)
-    for line in open(filename, "r"):
-        line = line.rstrip("\n")
-        if line.startswith("ID" + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = {}
-            temp = dict(zip(header, things))
-        if temp:
-            cmplx = format_hash(temp)
-            feat_row, peaks = gen_feat(cmplx, goobj, gaf)
-            if feat_row and peaks:
-                feat_file.append(feat_row)
-                [peaks_file.append(x) for x in list(peaks)]
+    cmplx_df = io.read_table(
+        filename,
+        usecols=lambda x: x in ["ID", "MB", "FT"],
+        keep_default_na=False,
+    )
+    # profiles of the normalize stage if not in the FT column
+    store = None
+    if "FT" not in cmplx_df:
+        store = io.ProfileStore(os.path.dirname(filename)).load()
+    records = cmplx_df.to_dict("records")
+    chunks = [records[i : i + chunk] for i in range(0, len(records), chunk)]
+    workers = get_workers(workers, len(chunks))
+    if workers > 1:
+        init = (goobj, gaf, store)
+        with mult_proc.Pool(workers, initializer=init_worker, initargs=init) as p:
+            res = p.map(feat_chunk, chunks, chunksize=1)
+    else:
+        init_worker(goobj, gaf, store)
+        res = [feat_chunk(x) for x in chunks]
+    feat_file = [x for feat, _, _ in res for x in feat]
+    peaks_file = [x for _, pks, _ in res for x in pks]
+    pairs = sum([x for _, _, x in res])
+    perf.count(complexes_in=cmplx_df.shape[0], pairs=pairs)
     return feat_file, peaks_file
 
 
-def runner(base, go_obo, tsp_go):
+def runner(base, go_obo, tsp_go, fmt="txt", feat_export="False", workers=1):
     """
     generate all features from the mapped complexes file
     base = config[GLOBAL][TEMP]filename
+    fmt = format of the tmp files (txt or npz)
+    classifier features go to a float32 matrix, COR, SHFT, DIF and W are
+    written to mp_feat_norm only if feat_export is True
+    workers = processes scoring the complexes (0 is one per CPU)
     """
-    go_tree = go.from_obo(io.resource_path(go_obo))
-    gaf = go.read_gaf_out(io.resource_path(tsp_go))
+    go_tree = cache.go_dag(io.resource_path(go_obo))
+    gaf = cache.gaf(io.resource_path(tsp_go))
     # get tmp/filename folder
-    cmplx_comb = os.path.join(base, "cmplx_combined.txt")
+    cmplx_comb = io.tmp_file(base, "cmplx_combined")
     # print(os.path.dirname(os.path.realpath(__file__)))
-    wr, pks = mp_cmplx(filename=cmplx_comb, goobj=go_tree, gaf=gaf)
-    feature_path = os.path.join(base, "mp_feat_norm.txt")
+    wr, pks = mp_cmplx(
+        filename=cmplx_comb, goobj=go_tree, gaf=gaf, workers=int(workers)
+    )
+    feature_path = io.tmp_file(base, "mp_feat_norm", fmt)
     feat_header = [
         "ID",
         "MB",
@@ -392,8 +451,17 @@ def runner(base, go_obo, tsp_go):
         "SC_BP",
         "TOTS",
     ]
-    io.wrout(wr, feature_path, feat_header)
-    peaklist_path = os.path.join(base, "peak_list.txt")
-    # peaklist_path = peaklist_path
-    io.wrout(pks, peaklist_path, ["MB", "ID", "PKS", "SEL"])
+    wr = pd.DataFrame(wr, columns=feat_header)
+    for col in ["COR", "DIF"]:
+        wr[col] = io.to_cells(list(wr[col]))
+    X, memo = io.feat2matrix(wr)
+    perf.count(complexes_out=X.shape[0])
+    io.FeatureMatrix(base).write_rows(list(memo[:, 0]), X)
+    if feat_export != "True":
+        wr = wr.drop(["COR", "SHFT", "DIF", "W"], axis=1)
+    io.write_table(wr, feature_path)
+    peaklist_path = io.tmp_file(base, "peak_list", fmt)
+    pks = pd.DataFrame(pks, columns=["MB", "ID", "PKS", "SEL"])
+    pks["SEL"] = pd.to_numeric(pks["SEL"], errors="coerce")
+    io.write_table(pks, peaklist_path)
     return True
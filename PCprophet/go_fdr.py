@@ -168,7 +168,6 @@ def fdr_from_GO(cmplx_comb, target_fdr, fdrfile):
     hypo = pos[(pos["ANN"] != 1) & (pos["TOTS"] > 0)]
     db = cmplx_comb[cmplx_comb["ANN"] == 1]
     db_use = eval_complexes(cmplx_comb)
-    io.create_file(fdrfile, ["fdr", "sumGO"])
     if target_fdr > 0:
         thresh = list(pos["TOTS"])
         go_cutoff = 0
@@ -186,13 +185,13 @@ def fdr_from_GO(cmplx_comb, target_fdr, fdrfile):
             ppi_db = db2ppi(db_use["MB"])
             thresh_fdr, conf_m = calc_fdr(hypo, ppi_db, thresh)
             go_cutoff = estimate_cutoff(thresh_fdr, thresh, target_fdr)
-            io.create_file(fdrfile + ".conf_m", ["tp" "fp" "tn" "fn"])
-            for pairs in zip(conf_m, thresh):
-                io.dump_file(fdrfile + ".conf_m", "\t".join(map(str, pairs)))
-        for pairs in zip(thresh_fdr, thresh):
-            io.dump_file(fdrfile, "\t".join(map(str, pairs)))
+            with io.BatchWriter(fdrfile + ".conf_m", ["tp" "fp" "tn" "fn"]) as out:
+                out.dump_all(["\t".join(map(str, x)) for x in zip(conf_m, thresh)])
+        with io.BatchWriter(fdrfile, ["fdr", "sumGO"]) as out:
+            out.dump_all(["\t".join(map(str, x)) for x in zip(thresh_fdr, thresh)])
         print("Estimated GO cutoff is {}".format(go_cutoff))
         return filter_hypo(cmplx_comb, go_cutoff), zip(thresh_fdr, thresh, nm)
     else:
         print("No FDR control performed")
+        io.create_file(fdrfile, ["fdr", "sumGO"])
         return filter_hypo(cmplx_comb, 0), zip([0], [0], [0])
@@ -9,25 +9,8 @@ import uuid
 
 import PCprophet.stats_ as st
 import PCprophet.io_ as io
-
-
-# standardize and center methods
-def center_arr(hoa, fr_nr="all", norm=True, nat=True, stretch=(True, 72)):
-    hypo = {}
-    for k in hoa:
-        key = hoa[k]
-        if fr_nr != "all":
-            key = key[0:(fr_nr)]
-        if len([x for x in key if x > 0]) < 2:
-            continue
-        key = st.gauss_filter(key, sigma=1, order=0)
-        key = st.impute_namean(key)
-        if stretch[0]:
-            # input original length wanted length
-            key = st.resample(key, len(key), output_fr=stretch[1])
-        key = st.resize(key)
-        hypo[k] = list(key)
-    return hypo
+import PCprophet.normalize as normalize
+import PCprophet.perf as perf
 
 
 def split_peaks(prot_arr, pr, skp=0):
@@ -82,39 +65,60 @@ def zero_sequence(arr):
         idx += 1
 
 
-def decondense(df, ids):
+def leaf_ranges(rows):
     """
-    decondense a linkage matrix into all flat clusters
+    leaf order of a linkage matrix and the [start, stop) range of every node
+    in it, the members of a node (left child then right child) are
+    contiguous in the leaf order
+    """
+    n = rows.shape[0] + 1
+    children = rows[:, :2].astype(np.int64)
+    size = np.ones(2 * n - 1, dtype=np.int64)
+    size[n:] = rows[:, 3]
+    start = np.zeros(2 * n - 1, dtype=np.int64)
+    # from the root down
+    for row in range(n - 2, -1, -1):
+        left, right = children[row]
+        start[left] = start[row + n]
+        start[right] = start[row + n] + size[left]
+    order = np.empty(n, dtype=np.int64)
+    order[start[:n]] = np.arange(n)
+    return order, start, start + size
+
+
+def decondense(df, ids, min_size=2, max_size=100):
+    """
+    decondense a linkage matrix into the flat clusters with min_size to
+    max_size members, yielded in linkage order
+    only the yielded member lists are built, the others are index ranges
     """
-    clusters = {}
     rows = cluster.hierarchy.linkage(df)
-    lab = dict(zip(range(len(ids) + 1), ids))
-    for row in range(rows.shape[0]):
-        cluster_n = row + len(ids)
-        glob1, glob2 = rows[row, 0], rows[row, 1]
-        current = []
-        for glob in [glob1, glob2]:
-            if glob > (len(ids) - 1):
-                current += clusters[glob]
-            else:
-                current.append(lab[int(glob)])
-        clusters[cluster_n] = current
-    return clusters
-
-
-def format_cluster(hoa, clust):
+    order, start, stop = leaf_ranges(rows)
+    size = stop - start
+    for node in range(len(ids), len(size)):
+        if min_size <= size[node] <= max_size:
+            yield [ids[x] for x in order[start[node] : stop[node]]]
+
+
+def format_cluster(hoa, clust, ft=True):
+    """
+    format clusters (member lists) into members => profiles
+    with ft=False profiles are not copied (they are read from io.ProfileStore)
+    """
     out = {}
-    lk = {k: ",".join(map(str, v)) for k, v in hoa.items()}
-    for gn in clust.values():
-        if len(gn) > 1 and len(gn) <= 100:
-            gn = [x if x in lk else re.sub("_\d+$", "", x) for x in gn]
-            out["#".join(gn)] = ["#".join([lk[x] for x in gn])]
+    for gn in clust:
+        gn = [x if x in hoa else re.sub("_\d+$", "", x) for x in gn]
+        out["#".join(gn)] = np.array([hoa[x] for x in gn]) if ft else None
     return out
 
 
-def collapse_prot(infile, use):
-    prot = io.read_txt(infile, "GN")
-    prot = center_arr(prot, fr_nr=use, stretch=(True, 72))
+def collapse_prot(infile, use, ft=True):
+    """
+    hypothesis from the normalized profiles of infile (normalize stage)
+    """
+    store, _ = normalize.load(infile, use)
+    prot = store.to_dict()
+    perf.count(proteins_in=len(prot))
     prot2 = {}
     for pr in prot:
         pks = split_peaks(prot[pr], pr)
@@ -123,28 +127,31 @@ def collapse_prot(infile, use):
                 prot2[k] = pks[k]
     pr_df = io.create_df(prot2)
     z = decondense(pr_df, list(pr_df.index))
-    hypothesis = format_cluster(prot, z)
-    hypo_df = pd.DataFrame.from_dict(hypothesis).T
-    hypo_df['ID'] = ["cmplx_" + str(uuid.uuid4()) for x in list(hypo_df.index)]
+    hypothesis = format_cluster(prot, z, ft=ft)
+    hypo_df = pd.DataFrame(
+        {"MB": list(hypothesis.keys()), "FT": io.to_cells(list(hypothesis.values()))}
+    )
+    hypo_df["ID"] = ["cmplx_" + str(uuid.uuid4()) for x in list(hypo_df.index)]
     #  return peaks2prot(hypothesis, prot),pr_df
     return hypo_df, pr_df
 
 
-def runner(infile, hypothesis, use_fr):
+def runner(infile, hypothesis, use_fr, fmt="txt", prof_store="False"):
     """
     generate hypothesis from infile using all fract fractions and max hypo nr
+    fmt = format of the tmp files (txt or npz)
+    prof_store = skip the FT column as profiles are in io.ProfileStore
     """
     if hypothesis == "all":
         print("Generating hypothesis for " + infile)
-        hypo, df_s = collapse_prot(infile=infile, use=use_fr)
+        ft = prof_store != "True"
         base = io.file2folder(infile, prefix="./tmp/")
-        # nm = os.path.join(base, "hypo.txt")
-        hypo.reset_index(inplace=True)
-        hypo.columns = ["MB", "FT", "ID"]
-        hypo = hypo[["ID", "MB", "FT"]]
-        hypo.to_csv(os.path.join(base, "hypo.txt"), sep="\t", index=False)
+        hypo, df_s = collapse_prot(infile=infile, use=use_fr, ft=ft)
+        hypo = hypo[["ID", "MB", "FT"] if ft else ["ID", "MB"]]
+        perf.count(hypotheses_out=hypo.shape[0])
+        io.write_table(hypo, io.tmp_file(base, "hypo", fmt))
         # io.wrout(hypo, nm, ["ID", "MB", "FT"], is_hyp=True)
-        df_s.to_csv(os.path.join(base, "splitted_transf.txt"), sep="\t")
+        io.write_table(df_s, io.tmp_file(base, "splitted_transf", fmt), index=True)
         return True
     else:
         pass
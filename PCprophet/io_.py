@@ -1,15 +1,21 @@
 import re
+import gzip
 import pandas as pd
 import numpy as np
+from scipy import sparse
 import sys
 import os
-import networkx as nx
 from datetime import datetime
 from collections import defaultdict
 import random
 import time
 import uuid
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 def makehash(w=dict):
     """autovivification like hash in perl
@@ -80,7 +86,7 @@ def reformat_dict(dic, is_list=False):
 
 
 def df2dict(path, k, v):
-    tmp = pd.read_csv(path, sep="\t")
+    tmp = read_csv(path, sep="\t")
     return dict(zip(list(tmp[k]), list(tmp[v])))
 
 
@@ -103,19 +109,8 @@ def read_sample_ids_diff(info_path):
     read sample ids and return a hash
     cond => short ID
     """
-    header = []
-    HoH = {}
-    temp = {}
-    for line in open(info_path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("Sample") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            HoH[temp["cond"]] = temp["short_id"]
-    return HoH
+    df = read_tab(info_path, usecols=["cond", "short_id"])
+    return dict(zip(df["cond"], df["short_id"]))
 
 
 def create_df(prot_dict):
@@ -132,7 +127,7 @@ def create_file(filename, header):
     create file in filename
     header is list
     """
-    with open(filename, "w", encoding="utf-8") as outfile:
+    with open_file(filename, "w") as outfile:
         outfile.write("%s\n" % "\t".join([str(x) for x in header]))
 
 
@@ -140,48 +135,153 @@ def dump_file(filename, things):
     """
     dump things to file to filename
     """
-    with open(filename, "a", encoding="utf-8") as outfile:
+    with open_file(filename, "a") as outfile:
         outfile.write("%s\n" % things)
 
 
+# magic bytes and file extension of the supported compressions
+COMPRESS_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+COMPRESS_EXT = {"gzip": "gz", "zstd": "zst"}
+
+
+def detect_compression(filename, mode="r"):
+    """
+    return the compression of filename (gzip, zstd or None)
+    files to read or append to are tested on the magic bytes
+    new files on the extension
+    """
+    if mode != "w" and os.path.isfile(filename):
+        with open(filename, "rb") as infile:
+            head = infile.read(4)
+        for k, v in COMPRESS_MAGIC.items():
+            if head.startswith(v):
+                return k
+        return None
+    for k, v in COMPRESS_EXT.items():
+        if filename.endswith("." + v):
+            return k
+    return None
+
+
+def strip_compression(filename):
+    """
+    remove the compression extension (if any) from filename
+    """
+    for v in COMPRESS_EXT.values():
+        if filename.endswith("." + v):
+            return filename[: -len(v) - 1]
+    return filename
+
+
+def open_file(filename, mode="r", compress=None):
+    """
+    open filename in text mode
+    compress can be None for plain text, gzip or zstd
+    if not given it is detected from the content or the extension
+    """
+    if compress is None:
+        compress = detect_compression(filename, mode)
+    if compress is None:
+        return open(filename, mode, encoding="utf-8")
+    elif compress == "gzip":
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    elif compress == "zstd":
+        if zstandard is None:
+            raise ImportError("zstandard is required for {}".format(filename))
+        return zstandard.open(filename, mode + "t", encoding="utf-8")
+    raise ValueError("Unknown compression {}".format(compress))
+
+
+def read_csv(path, **kwargs):
+    """
+    pd.read_csv on plain or compressed files
+    """
+    compress = detect_compression(path)
+    if compress is None:
+        return pd.read_csv(path, compression=None, **kwargs)
+    with open_file(path, "r", compress) as infile:
+        return pd.read_csv(infile, **kwargs)
+
+
+class BatchWriter(object):
+    """
+    buffered replacement for create_file followed by many dump_file
+    rows are kept in memory and written every size rows or on exit
+    with BatchWriter(filename, header) as out:
+        out.dump(row)
+    """
+
+    def __init__(self, filename, header=None, size=10000, mode="w", compress=None):
+        super(BatchWriter, self).__init__()
+        self.filename = filename
+        self.header = header
+        self.size = size
+        self.mode = mode
+        self.compress = compress
+        self.rows = []
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open_file(self.filename, self.mode, self.compress)
+        if self.header is not None:
+            self.dump("\t".join([str(x) for x in self.header]))
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+        self.handle.close()
+        self.handle = None
+        return False
+
+    def dump(self, things):
+        self.rows.append("%s\n" % things)
+        if len(self.rows) >= self.size:
+            self.flush()
+
+    def dump_all(self, things):
+        for x in things:
+            self.dump(x)
+
+    def flush(self):
+        if self.rows:
+            self.handle.write("".join(self.rows))
+            self.rows = []
+
+
+def read_tab(path, usecols=None, dtype=str, **kwargs):
+    """
+    read a tab delimited file into a typed DataFrame
+    by default every column is kept as verbatim string (no NA conversion)
+    floats are parsed with round_trip so values are identical to float()
+    """
+    return read_csv(
+        path,
+        sep="\t",
+        usecols=usecols,
+        dtype=dtype,
+        keep_default_na=False,
+        float_precision="round_trip",
+        **kwargs
+    )
+
+
 def read_pred(pred_path):
     """
     collapse prediction into protein groups
     need to modify prediction to add complex member and also protein names
     """
-    header = []
-    temp = {}
-    test = {}
-    for line in open(pred_path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("ID") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-            # # TODO deal with duplicate entries in database
-            test[temp["ID"]] = float(temp["POS"])
-    return test
+    df = read_tab(pred_path, usecols=["ID", "POS"], dtype={"ID": str, "POS": float})
+    # # TODO deal with duplicate entries in database
+    return dict(zip(df["ID"], df["POS"]))
 
 
 def read_mp_feat(pred_path):
     """
     if no prediction was done take mp_feat_norm
     """
-    header = []
-    temp = {}
+    df = read_tab(pred_path, usecols=["ID", "MB"])
     test = makehash()
-    for line in open(pred_path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("ID") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            # need to deal with error being a thing or empty col
-            temp = dict(zip(header, things))
-            test[temp["ID"]] = []
-            test[temp["ID"]].extend(temp["MB"].split("#"))
-            # test[temp['ID']][temp['MB']] = 'yes'
+    test.update(zip(df["ID"], df["MB"].str.split("#")))
     return test
 
 
@@ -189,19 +289,10 @@ def read_matrix(path, arr=False):
     """
     read matrix and returns HoA[protein] = # delim int
     """
-    header = []
+    df = read_tab(path)
+    cols = [x for x in df.columns if x != "ID"]
     HoA = makehash()
-    temp = {}
-    for line in open(path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("ID") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            val = "#".join([temp[key] for key in header if key != "ID"])
-            HoA[temp["ID"]] = val
+    HoA.update(zip(df["ID"], df[cols[0]].str.cat(df[cols[1:]], sep="#")))
     return HoA
 
 
@@ -211,19 +302,10 @@ def read_peaks(path, arr=False):
     prot  peaks selected cmplx name
     output hash cmplx name prot => peaks selected
     """
-    header = []
+    df = read_tab(path, usecols=["MB", "ID", "PKS", "SEL"])
     HoA = makehash()
-    temp = {}
-    for line in open(path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith("MB\tID"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            row = "\t".join([temp["PKS"], temp["SEL"]])
-            HoA[temp["ID"]][temp["MB"]] = row
+    for mb, ids, row in zip(df["MB"], df["ID"], df["PKS"] + "\t" + df["SEL"]):
+        HoA[ids][mb] = row
     return HoA
 
 
@@ -231,43 +313,26 @@ def read_sample_ids(info_path):
     """
     read sample to treatment
     """
-    header = []
-    HoH = {}
-    temp = {}
-    for line in open(info_path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("Sample") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            HoH[temp["Sample"]] = "_".join([temp["cond"], temp["repl"]])
-    return HoH
+    df = read_tab(info_path, usecols=["Sample", "cond", "repl"])
+    return dict(zip(df["Sample"], df["cond"] + "_" + df["repl"]))
 
 
 def read_txt(path, first_col="GN"):
     """
     read a tab delimited file giving a path and the first column name
     return a hash of hashes prot => sample => val
-    """
-    header = []
+    only numeric columns are kept as values
+    """
+    df = read_csv(
+        path,
+        sep="\t",
+        index_col=first_col,
+        dtype={first_col: str, "ID": str},
+        float_precision="round_trip",
+    )
     HoA = makehash()
-    temp = {}
-    for line in open(path, "r"):
-        line = line.rstrip("\n")
-        if line.startswith(str(first_col) + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            HoA[temp.get("GN")] = []
-            for key in header:
-                try:
-                    HoA[temp.get("GN")].append(float(temp[key]))
-                except ValueError:
-                    continue
+    num = df.select_dtypes(include=[np.number]).astype(float)
+    HoA.update(zip(num.index, num.values.tolist()))
     return HoA
 
 
@@ -277,27 +342,66 @@ def read_cal(infile):
     """
     out = []
     out2 = []
-    for line in open(infile, "r"):
+    for line in open_file(infile):
         tmp_ = re.split(r"\t+", line.rstrip("\n"))
         out.append(int(tmp_[0]))
         out2.append(float(tmp_[1]))
     return out, out2
 
 
-def ppi2graph(infile):
-    df = pd.read_csv(infile, sep="\t")
-    ppi = dict(zip(df["protA"], df["protB"]))
-    n = nx.Graph()
-    for k in ppi.keys():
-        n.add_edge(k, ppi[k])
-    return n
+def ppi2csr(infile, score=None, thresh=0, chunksize=10**6):
+    """
+    read a protA protB edge list in chunks into a symmetric CSR adjacency
+    proteins are numbered in order of appearance
+    with a score column edges below thresh are dropped and the edge weight
+    is the score (max of duplicated edges), otherwise all weights are 1
+    returns the matrix and the protein names
+    """
+    usecols = ["protA", "protB"] + ([score] if score else [])
+    names = pd.Index([], dtype=object)
+    src, dst, weight = [], [], []
+    with open_file(infile) as fh:
+        reader = pd.read_csv(
+            fh,
+            sep="\t",
+            usecols=usecols,
+            dtype={"protA": str, "protB": str},
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            chunk = chunk.dropna()
+            if score:
+                chunk = chunk[chunk[score] >= thresh]
+            # interleaved A B A B so ids follow the order of appearance
+            pairs = chunk[["protA", "protB"]].to_numpy().ravel()
+            new = pd.unique(pairs)
+            names = names.append(pd.Index(new[names.get_indexer(new) < 0]))
+            ids = names.get_indexer(pairs)
+            src.append(ids[0::2])
+            dst.append(ids[1::2])
+            w = chunk[score].to_numpy(float) if score else np.ones(chunk.shape[0])
+            weight.append(w)
+    n = len(names)
+    if not src or not sum([len(x) for x in src]):
+        return sparse.csr_matrix((n, n)), list(names)
+    src, dst, weight = [np.concatenate(x) for x in [src, dst, weight]]
+    # undirected, every edge in both directions
+    key = np.concatenate([src * n + dst, dst * n + src]).astype(np.int64)
+    weight = np.concatenate([weight, weight])
+    order = np.argsort(key, kind="stable")
+    key, weight = key[order], weight[order]
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    weight = np.maximum.reduceat(weight, first)
+    key = key[first]
+    mat = sparse.csr_matrix((weight, (key // n, key % n)), shape=(n, n))
+    return mat, list(names)
 
 
 def wrout(d, filename, header, is_hyp=False):
     """
     giving a list, a filename and a set of headers (tab delimited)
     """
-    with open(filename, "w", encoding="utf-8") as outfile:
+    with open_file(filename, "w") as outfile:
         outfile.write("\t".join(header) + "\n")
         for k in d:
             if is_hyp:
@@ -311,34 +415,367 @@ def wrout(d, filename, header, is_hyp=False):
     return True
 
 
+# extensions available for the per-sample intermediates in tmp/
+TMP_FMT = ["txt", "txt.gz", "txt.zst", "npz"]
+
+
+def tmp_format(fmt, compress="False"):
+    """
+    extension of the tmp files from the format and the compression switch
+    npz archives are binary and never compressed further
+    """
+    if compress in COMPRESS_EXT and fmt != "npz":
+        return ".".join([fmt, COMPRESS_EXT[compress]])
+    return fmt
+
+
+def tmp_file(base, name, fmt=None):
+    """
+    path of the intermediate name (without extension) in the sample folder
+    if fmt is None returns the most recent file written in any format
+    """
+    if fmt:
+        return os.path.join(base, ".".join([name, fmt]))
+    paths = [os.path.join(base, ".".join([name, x])) for x in TMP_FMT]
+    found = [x for x in paths if os.path.isfile(x)]
+    if not found:
+        return paths[0]
+    return max(found, key=os.path.getmtime)
+
+
+def to_cells(arrs):
+    """
+    pack a list of arrays in a 1d object array usable as DataFrame column
+    """
+    cells = np.empty(len(arrs), dtype=object)
+    for idx, arr in enumerate(arrs):
+        cells[idx] = arr
+    return cells
+
+
+def is_profile(col):
+    """
+    test if a DataFrame column holds arrays (i.e profiles) instead of scalars
+    """
+    if col.dtype != object or col.empty:
+        return False
+    return isinstance(col.iloc[0], (np.ndarray, list))
+
+
+def format_profiles(arr):
+    """
+    format a profile cell as text
+    rows are # delimited and values are , delimited
+    """
+    if isinstance(arr, str):
+        return arr
+    arr = np.asarray(arr)
+    if arr.ndim == 1:
+        return ",".join([str(x) for x in arr])
+    return "#".join([",".join([str(x) for x in row]) for row in arr])
+
+
+def parse_profiles(cell):
+    """
+    return a 2d float array from a # and , delimited cell or from an array
+    """
+    if isinstance(cell, str):
+        return np.array([x.split(",") for x in cell.split("#")], dtype=float)
+    return np.atleast_2d(cell)
+
+
+def write_npz(df, path, index=False):
+    """
+    write a DataFrame column wise into a .npz archive
+    profile columns are stacked into a single float matrix plus row offsets
+    so they can be read back without any string parsing
+    string columns are stored as concatenated utf-8 bytes plus row offsets
+    (fixed width numpy strings would pad every row to the longest one)
+    """
+    if index:
+        df = df.reset_index()
+    arrs, kinds = {}, []
+    for nr, col in enumerate(df.columns):
+        key = "c{}".format(nr)
+        if is_profile(df[col]):
+            mats = [np.atleast_2d(np.asarray(x, dtype=float)) for x in df[col]]
+            arrs[key] = np.concatenate(mats)
+            arrs[key + "_ptr"] = np.cumsum([0] + [x.shape[0] for x in mats])
+            kinds.append("prof{}".format(np.ndim(df[col].iloc[0])))
+        elif df[col].dtype == object:
+            enc = [str(x).encode("utf-8") for x in df[col].fillna("")]
+            arrs[key] = np.frombuffer(b"".join(enc), dtype=np.uint8)
+            arrs[key + "_ptr"] = np.cumsum([0] + [len(x) for x in enc])
+            kinds.append("text")
+        else:
+            arrs[key] = df[col].values
+            kinds.append("num")
+    arrs["columns"] = np.array([str(x) for x in df.columns])
+    arrs["kinds"] = np.array(kinds, dtype=str)
+    with open(path, "wb") as outfile:
+        np.savez(outfile, **arrs)
+    return True
+
+
+def read_npz(path, index_col=None, usecols=None):
+    """
+    read a .npz archive created by write_npz
+    profile cells are returned as views of the stacked matrix
+    """
+    npz = np.load(path, allow_pickle=False)
+    cols = list(npz["columns"])
+    out = {}
+    keep = usecols if callable(usecols) else lambda x: x in usecols
+    for nr, (col, kind) in enumerate(zip(cols, npz["kinds"])):
+        if usecols and not keep(col) and col != index_col:
+            continue
+        key = "c{}".format(nr)
+        if kind.startswith("prof"):
+            data, ptr = npz[key], npz[key + "_ptr"]
+            cells = [data[ptr[i] : ptr[i + 1]] for i in range(len(ptr) - 1)]
+            if kind == "prof1":
+                cells = [x[0] for x in cells]
+            out[col] = to_cells(cells)
+        elif kind == "text":
+            raw, ptr = npz[key].tobytes(), npz[key + "_ptr"]
+            cells = [raw[a:b].decode("utf-8") for a, b in zip(ptr[:-1], ptr[1:])]
+            out[col] = pd.Series(cells, dtype=object).replace("", np.nan).values
+        else:
+            out[col] = npz[key]
+    df = pd.DataFrame(out, columns=[x for x in cols if x in out])
+    if index_col:
+        df.set_index(index_col, inplace=True)
+    return df
+
+
+def write_table(df, path, index=False):
+    """
+    write a tmp table in the format given by the path extension
+    profile cells are converted to # and , delimited strings for text
+    """
+    if path.endswith(".npz"):
+        return write_npz(df, path, index=index)
+    prof = [x for x in df.columns if is_profile(df[x])]
+    if prof:
+        df = df.copy()
+        for col in prof:
+            df[col] = df[col].apply(format_profiles)
+    with open_file(path, "w") as outfile:
+        df.to_csv(outfile, sep="\t", index=index)
+    return True
+
+
+def read_table(path, index_col=None, usecols=None, **kwargs):
+    """
+    read a tmp table written by write_table
+    kwargs are passed to pd.read_csv for text files
+    """
+    if path.endswith(".npz"):
+        return read_npz(path, index_col=index_col, usecols=usecols)
+    return read_csv(path, sep="\t", index_col=index_col, usecols=usecols, **kwargs)
+
+
+class ProfileStore(object):
+    """
+    docstring for ProfileStore
+    per sample store of the normalized protein profiles
+    profiles are saved once as a float matrix (name.npy) with a gene name
+    index (name_idx.txt) and read back memory mapped, so complexes only
+    need to carry the member names
+    """
+
+    dtype = float
+
+    def __init__(self, base, name="profiles"):
+        super(ProfileStore, self).__init__()
+        self.base = base
+        self.name = name
+        self.mat = None
+        self.names = []
+        self.idx = {}
+
+    def get_paths(self):
+        mat = os.path.join(self.base, self.name + ".npy")
+        idx = os.path.join(self.base, self.name + "_idx.txt")
+        return mat, idx
+
+    def exists(self):
+        return all([os.path.isfile(x) for x in self.get_paths()])
+
+    def write(self, prot):
+        """
+        write a prot => profile hash to disk
+        """
+        names = list(prot.keys())
+        return self.write_rows(names, [prot[k] for k in names])
+
+    def write_rows(self, names, mat):
+        """
+        write a matrix with one row per name
+        """
+        mat_path, idx_path = self.get_paths()
+        np.save(mat_path, np.array(mat, dtype=self.dtype).reshape(len(names), -1))
+        with open(idx_path, "w", encoding="utf-8") as outfile:
+            outfile.write("".join([x + "\n" for x in names]))
+        return self.load()
+
+    def load(self):
+        mat_path, idx_path = self.get_paths()
+        self.mat = np.load(mat_path, mmap_mode="r")
+        with open(idx_path, "r", encoding="utf-8") as infile:
+            self.names = infile.read().splitlines()
+        self.idx = dict(zip(self.names, range(len(self.names))))
+        return self
+
+    def rows(self, members):
+        return [self.idx[x] for x in members]
+
+    def get(self, acc):
+        """
+        return the profile of acc as a view of the memory mapped matrix
+        """
+        return self.mat[self.idx[acc]]
+
+    def to_dict(self):
+        """
+        name => profile (list) hash as read by read_txt
+        """
+        return dict(zip(self.names, self.mat.tolist()))
+
+    def to_df(self):
+        """
+        profiles as DataFrame indexed by ID
+        """
+        return pd.DataFrame(np.asarray(self.mat), index=pd.Index(self.names, name="ID"))
+
+
+class FeatureMatrix(ProfileStore):
+    """
+    docstring for FeatureMatrix
+    per sample dense float32 matrix of the classifier features
+    (SHFT, W, COR and DIF) with the complex ID as index
+    """
+
+    dtype = np.float32
+
+    def __init__(self, base, name="feat_matrix"):
+        super(FeatureMatrix, self).__init__(base, name)
+
+
+class ComplexIndex(object):
+    """
+    docstring for ComplexIndex
+    complex database compiled to integer codes, complexes are rows and
+    subunits (upper case gene names) columns of a sparse incidence matrix
+    (subunits listed twice count twice), its columns are the gene => complex
+    inverted index
+    the subunits of every complex are also kept in database order
+    """
+
+    def __init__(self, names, genes, indptr, indices):
+        super(ComplexIndex, self).__init__()
+        self.names = names
+        self.genes = genes
+        self.gene_idx = dict(zip(genes, range(len(genes))))
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        shape = (len(names), len(genes))
+        self.incidence = sparse.csr_matrix(
+            (np.ones(len(self.indices)), self.indices.copy(), self.indptr.copy()),
+            shape=shape,
+        )
+        self.incidence.sum_duplicates()
+        self.inverted = self.incidence.tocsc()
+        self.sizes = np.diff(self.indptr)
+
+    def presence(self, prot):
+        """
+        boolean gene vector, True for the genes in prot
+        """
+        present = np.zeros(len(self.genes), dtype=bool)
+        present[[self.gene_idx[x] for x in prot if x in self.gene_idx]] = True
+        return present
+
+    def complexes(self, gene):
+        """
+        row index of the complexes with gene as subunit
+        """
+        if gene not in self.gene_idx:
+            return np.array([], dtype=np.int64)
+        lo, hi = self.inverted.indptr[self.gene_idx[gene] : self.gene_idx[gene] + 2]
+        return self.inverted.indices[lo:hi]
+
+    def select(self, prot, min_size=2):
+        """
+        complexes with at least min_size subunits in prot
+        returns complex rows, completeness and the subunits found in prot
+        """
+        present = self.presence(prot)
+        hits = self.incidence @ present.astype(float)
+        rows = np.flatnonzero(hits >= min_size)
+        cmplt = hits[rows] / self.sizes[rows]
+        found = present[self.indices]
+        memb = []
+        for i in rows:
+            sl = slice(self.indptr[i], self.indptr[i + 1])
+            memb.append([self.genes[x] for x in self.indices[sl][found[sl]]])
+        return rows, cmplt, memb
+
+
+def read_complex_db(path):
+    """
+    parse a complex database (ComplexID, ComplexName, subunits(Gene name))
+    into a ComplexIndex
+    """
+    header = []
+    temp = {}
+    names, genes, indptr, indices = [], {}, [0], []
+    for line in open_file(path):
+        line = line.rstrip("\n")
+        if line.startswith("ComplexID" + "\t"):
+            header = re.split(r"\t+", line)
+        else:
+            things = re.split(r"\t+", line)
+            temp = dict(zip(header, things))
+        if temp:
+            members = re.split(r";", temp["subunits(Gene name)"])
+            for gn in members:
+                indices.append(genes.setdefault(str.upper(gn), len(genes)))
+            indptr.append(len(indices))
+            nm = temp["ComplexName"] + "_" + temp["ComplexID"]
+            names.append(nm.replace('"', ""))
+    return ComplexIndex(names, list(genes.keys()), indptr, indices)
+
+
 def read_combined(combfile):
     """
     receive a combined file and uniforms the annotation
     """
     HoA = makehashlist()
-    df = pd.read_csv(combfile, sep="\t")
+    df = read_csv(combfile, sep="\t")
     for index, row in df.iterrows():
         HoA[row["CMPLX"]].append(row["ID"])
     return HoA
 
 
-def create_db_from_cluster(nodes, clusters):
+def create_db_from_cluster(nodes, clusters, path=None):
     idx = 1
     ids = "ppi"
     header = ["ComplexID", "ComplexName", "subunits(Gene name)"]
-    path = resource_path("./ppi_db.txt")
-    create_file(path, header)
-    for cmplx in clusters:
-        nm = ";".join([str(nodes[x]) for x in list(cmplx)])
-        tmp = "_".join([ids, str(idx)])
-        dump_file(path, "\t".join([str(idx), tmp, nm]))
-        idx += 1
+    if path is None:
+        path = resource_path("./ppi_db.txt")
+    with BatchWriter(path, header) as out:
+        for cmplx in clusters:
+            nm = ";".join([str(nodes[x]) for x in list(cmplx)])
+            tmp = "_".join([ids, str(idx)])
+            out.dump("\t".join([str(idx), tmp, nm]))
+            idx += 1
     return True
 
 
 def file2folder(file_, prefix="./tmp/"):
     # we are already stripping the extension
-    filename = os.path.splitext(os.path.basename(file_))[0]
+    filename = os.path.splitext(strip_compression(os.path.basename(file_)))[0]
     return os.path.join(prefix, filename)
 
 
@@ -361,9 +798,9 @@ def split_hypo_db(pred, ref_cmplx, cmplx_ann):
     """
     read prediction ref cmplx and cmplx and return the positive
     """
-    pred = pd.read_csv(pred, sep="\t", index_col=False)
-    ref_cmplx = pd.read_csv(ref_cmplx, sep="\t")
-    ann = pd.read_csv(cmplx_ann, sep="\t")
+    pred = read_csv(pred, sep="\t", index_col=False)
+    ref_cmplx = read_csv(ref_cmplx, sep="\t")
+    ann = read_csv(cmplx_ann, sep="\t")
     on = ["ID"]
     xx = lambda x, y, on: pd.merge(x, y, how="left", left_on=on, right_on=on)
     mrg = xx(ann, xx(pred, ref_cmplx, on), ["ID"])
@@ -383,6 +820,8 @@ def uniqueid():
 
 
 def split_to_df(df, col, sep=","):
+    if is_profile(df[col]):
+        return pd.DataFrame(np.vstack(df[col].values), index=df.index.copy())
     tmp = pd.DataFrame(df[col].str.split(sep).tolist(), index=df.index.copy())
     return tmp
 
@@ -420,15 +859,50 @@ def explode(df, lst_cols, fill_value="", preserve_index=False):
     return res
 
 
+def explode_members(df, col, sep="#"):
+    """
+    explode the sep delimited members of col into one row per member
+    only distinct member strings are split, rows are repeated through the
+    integer coded complex => protein incidence and string columns come back
+    as categoricals, so every distinct string is stored once
+    """
+    cmplx, uniq = pd.factorize(df[col])
+    split = [x.split(sep) for x in uniq]
+    lens = np.array([len(x) for x in split])
+    codes, names = pd.factorize(np.concatenate(split))
+    # start of every complex in codes and of every row in the exploded frame
+    ptr = np.cumsum(lens) - lens
+    nmb = lens[cmplx]
+    rows = np.repeat(np.arange(df.shape[0]), nmb)
+    pos = np.arange(rows.size) - np.repeat(np.cumsum(nmb) - nmb, nmb)
+    codes = codes[ptr[cmplx][rows] + pos]
+    out = {col: pd.Categorical.from_codes(codes, names)}
+    for x in df.columns.drop(col):
+        if df[x].dtype == object:
+            codes, names = pd.factorize(df[x])
+            out[x] = pd.Categorical.from_codes(codes[rows], names)
+        else:
+            out[x] = df[x].values[rows]
+    return pd.DataFrame(out, columns=df.columns)
+
+
 def prepare_feat(infile, thresh=1, missing=["nan", "na", "", None, "n", "-"]):
     """
     read infile and split it
     """
-    feat = pd.read_csv(infile, sep="\t", na_values=missing)
-    feat.dropna(inplace=True)
+    feat = read_table(infile, na_values=missing)
+    return feat2matrix(feat, thresh=thresh, missing=missing)
+
+
+def feat2matrix(feat, thresh=1, missing=["nan", "na", "", None, "n", "-"]):
+    """
+    convert the features DataFrame (string or array COR/DIF) to the
+    numeric matrix used by the classifier and the matching IDs
+    """
+    feat = feat.dropna()
     memos = feat[["ID"]]
     torm = ["ID", "MB", "SC_CC", "SC_MF", "SC_BP", "TOTS"]
-    feat.drop(torm, axis=1, inplace=True)
+    feat = feat.drop(torm, axis=1)
     cor = split_to_df(feat, "COR")
     dif = split_to_df(feat, "DIF")
     feat2 = feat[["SHFT", "W"]]
@@ -1,116 +1,199 @@
 import sys
 import os
-import re
-import networkx as nx
+import hashlib
+import json
+import multiprocessing as mult_proc
+import numpy as np
+import pandas as pd
 
 import PCprophet.io_ as io
 import PCprophet.mcl as mc
+import PCprophet.normalize as normalize
+import PCprophet.perf as perf
+import PCprophet.resource_cache as cache
 import PCprophet.stats_ as st
 
 
-# standardize and center methods
-def center_arr(hoa, fr_nr="all", smooth=True, stretch=(True, 72), resc=True):
-    norm = {}
-    for k in hoa:
-        key = hoa[k]
-        if fr_nr != "all":
-            key = key[0:(fr_nr)]
-        # if less than 2 real values
-        if len([x for x in key if x > 0]) < 2:
-            continue
-        if smooth:
-            key = st.gauss_filter(key, sigma=1, order=0)
-        key = st.impute_namean(key)
-        if stretch[0]:
-            # input original length wanted length
-            key = st.resample(key, len(key), output_fr=stretch[1])
-        if resc:
-            key = st.resize(key)
-        norm[k] = list(key)
-    return norm
-
-
-def rec_mcl(path):
-    g = io.ppi2graph(path)
-    matrix = nx.to_scipy_sparse_matrix(g)
-    result = mc.run_mcl(matrix)
+# parameters of the ppi clustering, part of the cached database name
+MCL_PARAMS = {
+    "expansion": 2,
+    "inflation": [i / 10 for i in range(15, 26)],
+    "pruning_threshold": 0.001,
+}
+# bump when the clustering of the same network and parameters changes
+MCL_VERSION = 3
+# columns expanded at once, bounds the memory of an expansion step
+MCL_BLOCK = 4096
+
+
+def mcl_kind(score=None, thresh=0, inflation=None):
+    """
+    name of the cached clustering of a network, the whole inflation sweep
+    or a single inflation of it
+    """
+    par = dict(MCL_PARAMS, score=score, thresh=thresh, version=MCL_VERSION)
+    if inflation is not None:
+        par["inflation"] = inflation
+    par = ";".join(["{}={}".format(k, par[k]) for k in sorted(par)])
+    return "mcl_" + hashlib.sha1(par.encode()).hexdigest()[:10]
+
+
+def mcl_args(workers=1):
+    """
+    run_mcl arguments, workers threads expand blocks of MCL_BLOCK columns
+    converged columns are frozen
+    """
+    kw = {x: MCL_PARAMS[x] for x in ["expansion", "pruning_threshold"]}
+    return dict(kw, workers=workers, block_size=MCL_BLOCK, freeze=True)
+
+
+_SWEEP = {}
+
+
+def init_sweep(matrix, threads=1):
+    _SWEEP.update({"matrix": matrix, "threads": threads})
+
+
+def sweep_point(inflation):
+    """
+    clusters and modularity of one inflation from the shared self looped and
+    normalized matrix, expanded by blocks in the threads given to init_sweep
+    """
+    kw = mcl_args(_SWEEP["threads"])
+    result = mc.run_mcl(_SWEEP["matrix"], inflation=inflation, loop_value=0, **kw)
     clusters = mc.get_clusters(result)
-    opt = mc.run_mcl(matrix, inflation=optimize_mcl(matrix, result, clusters))
-    clusters = mc.get_clusters(opt)
-    node = dict(enumerate(g.nodes()))
-    io.create_db_from_cluster(node, clusters)
+    return inflation, clusters, mc.modularity(matrix=result, clusters=clusters)
+
+
+def write_point(point):
+    def writer(path, dest):
+        inflation, clusters, qscore = point
+        rec = {"inflation": inflation, "modularity": qscore, "clusters": clusters}
+        with open(dest, "w") as outfile:
+            json.dump(rec, outfile)
+
+    return writer
+
+
+def read_point(path):
+    with open(path) as infile:
+        rec = json.load(infile)
+    return [tuple(x) for x in rec["clusters"]], rec["modularity"]
+
+
+def sweep_mcl(path, matrix, score=None, thresh=0, workers=1):
+    """
+    inflation => (clusters, modularity) for the inflations of MCL_PARAMS
+    every inflation is cached on its own, the missing ones run in up to
+    workers processes starting from the same self looped and normalized
+    matrix, the CPUs left over expand the blocks of each run in threads
+    """
+    kinds = {x: mcl_kind(score, thresh, x) for x in MCL_PARAMS["inflation"]}
+    paths = {x: cache.derived_path(path, y, "json") for x, y in kinds.items()}
+    todo = [x for x in MCL_PARAMS["inflation"] if not os.path.isfile(paths[x])]
+    if todo:
+        start = mc.normalize(mc.add_self_loops(matrix, 1))
+        procs = min(workers, len(todo))
+        if mult_proc.current_process().daemon:
+            procs = 1
+        threads = max(1, workers // procs)
+        if procs > 1:
+            init = (start, threads)
+            with mult_proc.Pool(procs, initializer=init_sweep, initargs=init) as p:
+                res = p.map(sweep_point, todo, chunksize=1)
+        else:
+            init_sweep(start, threads)
+            res = [sweep_point(x) for x in todo]
+            _SWEEP.clear()
+        for point in res:
+            kind = kinds[point[0]]
+            paths[point[0]] = cache.derived(path, kind, write_point(point), "json")
+    return {x: read_point(y) for x, y in paths.items()}
+
+
+def rec_mcl(path, dest=None, score=None, thresh=0, workers=1):
+    """
+    cluster the ppi network in path and write the clusters as a database
+    score/thresh = optional edge score column and minimum score
+    the clusters of the inflation with the highest modularity are used
+    """
+    matrix, names = io.ppi2csr(path, score=score, thresh=thresh)
+    sweep = sweep_mcl(path, matrix, score, thresh, workers)
+    clusters, _ = sweep[optimize_mcl(sweep)]
+    node = dict(enumerate(names))
+    io.create_db_from_cluster(node, clusters, dest)
     return True
 
 
-def optimize_mcl(matrix, results, clusters):
-    newmax = 0
-    infl = 0
-    for inflation in [i / 10 for i in range(15, 26)]:
-        result = mc.run_mcl(matrix, inflation=inflation)
-        clusters = mc.get_clusters(result)
-        qscore = mc.modularity(matrix=result, clusters=clusters)
-        if qscore > newmax:
+def ppi_db(path, score="None", thresh=0, workers=1):
+    """
+    complex database from the MCL clusters of the ppi network in path
+    clustered once per network, edge filter and MCL_PARAMS, shared by samples
+    and runs
+    """
+    score = None if score == "None" else score
+    thresh = float(thresh)
+    writer = lambda x, y: rec_mcl(x, y, score=score, thresh=thresh, workers=workers)
+    return cache.derived(path, mcl_kind(score, thresh), writer)
+
+
+def optimize_mcl(sweep):
+    """
+    inflation with the highest modularity, the lowest one on ties
+    """
+    newmax = None
+    infl = None
+    for inflation in sorted(sweep):
+        qscore = sweep[inflation][1]
+        if newmax is None or qscore > newmax:
             infl = inflation
-            qscore = newmax
+            newmax = qscore
     return infl
 
 
-def runner(infile, db, is_ppi, use_fr):
+def runner(
+    infile,
+    db,
+    is_ppi,
+    use_fr,
+    fmt="txt",
+    prof_store="False",
+    ppi_score="None",
+    ppi_thresh=0,
+):
     """
     argv[1] = input name conv2gn out
     argv[2] = db
     argv[3] = is_ppi
+    ppi_score/ppi_thresh = edge score column and minimum score of a ppi db
+    fmt = format of the tmp files (txt or npz)
+    prof_store = profiles are only in the normalize io.ProfileStore, no FT column
     """
-    prot = io.read_txt(infile)
+    store, _ = normalize.load(infile, use_fr)
     print("mapping " + infile + " to " + db)
-    # write it for differential stretch it to assert same length
-    prot_notnorm = center_arr(prot, stretch=(True, 72), smooth=False, resc=False)
-    # perform normalization
-    prot = center_arr(prot, fr_nr=use_fr, stretch=(True, 72))
-    pr_df = io.create_df(prot)
-    pr_df = pr_df.loc[~(pr_df == 0).all(axis=1)]
-    pr_df.index.name = "ID"
-    header = []
-    temp = {}
-    out = []
     base = io.file2folder(infile, prefix="./tmp/")
-    # create tmp folder and subfolder with name
-    if not os.path.isdir(base):
-        os.makedirs(base)
-    # write transf matrix
-    dest = os.path.join(base, "transf_matrix.txt")
-    pr_df.to_csv(dest, sep="\t", encoding="utf-8")
-    # write raw data
-    prot_notnorm_df = io.create_df(prot_notnorm)
-    prot_notnorm_df.index.name = "ID"
-    prot_notnorm_df.to_csv(os.path.join(base, "raw.txt"), sep="\t")
     if is_ppi == "True":
         # cluster the ppi db into a database
-        rec_mcl(db)
-        db = io.resource_path("./ppi_db.txt")
-    for line in open(db, "r"):
-        line = line.rstrip("\n")
-        if line.startswith("ComplexID" + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if temp:
-            members = re.split(r";", temp["subunits(Gene name)"])
-            members = [str.upper(x) for x in members]
-            memb, feat = [], []
-            for cmplx in members:
-                if prot.get(cmplx, None):
-                    feat.append(",".join(str(x) for x in prot[cmplx]))
-                    memb.append(cmplx)
-            if len(feat) > 1:
-                nm = temp["ComplexName"] + "_" + temp["ComplexID"]
-                nm = nm.replace('"', "")
-                ft_v = "#".join(feat)
-                mb_v = "#".join(memb)
-                cmplt = float(len(memb)) / float(len(members))
-                out.append("\t".join([nm, str(cmplt), mb_v, ft_v]))
-    nm = os.path.join(base, "ann_cmplx.txt")
-    # nm = io.resource_path(nm)
-    io.wrout(out, nm, ["ID", "CMPLT", "MB", "FT"])
+        db = ppi_db(db, ppi_score, ppi_thresh)
+    index = cache.complex_db(db)
+    # all complexes with at least 2 subunits in the sample at once
+    rows, cmplt, memb = index.select(store.names)
+    out = []
+    for i, c, mb in zip(rows, cmplt, memb):
+        feat = []
+        if prof_store != "True":
+            feat = np.asarray(store.mat[store.rows(mb)])
+        out.append([index.names[i], c, "#".join(mb), feat])
+    out = pd.DataFrame(
+        {
+            "ID": [x[0] for x in out],
+            "CMPLT": [x[1] for x in out],
+            "MB": [x[2] for x in out],
+            "FT": io.to_cells([x[3] for x in out]),
+        }
+    )
+    if prof_store == "True":
+        out.drop("FT", axis=1, inplace=True)
+    perf.count(proteins_in=len(store.names), complexes_out=out.shape[0])
+    io.write_table(out, io.tmp_file(base, "ann_cmplx", fmt))
     return True
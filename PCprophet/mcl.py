@@ -1,10 +1,12 @@
 import numpy as np
-from scipy.sparse import isspmatrix, dok_matrix, csc_matrix
+from scipy.sparse import isspmatrix, dok_matrix, csc_matrix, csr_matrix
+from scipy.sparse import diags, identity, hstack
 import sklearn.preprocessing
 from fractions import Fraction
-from itertools import permutations
+from itertools import chain, permutations
 from scipy.sparse import isspmatrix, dok_matrix, find
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import networkx as nx
 from matplotlib.pylab import show, cm, axis
 
@@ -33,6 +35,16 @@ def sparse_allclose(a, b, rtol=1e-5, atol=1e-8):
     return c.max() <= atol
 
 
+def col_ids(matrix):
+    """
+    Column of every stored element of a CSC matrix
+
+    :param matrix: The CSC matrix
+    :returns: array with the column index of matrix.data
+    """
+    return np.repeat(np.arange(matrix.shape[1]), np.diff(matrix.indptr))
+
+
 def normalize(matrix):
     """
     Normalize the columns of the given matrix
@@ -40,6 +52,13 @@ def normalize(matrix):
     :param matrix: The matrix to be normalized
     :returns: The normalized matrix
     """
+    if isspmatrix(matrix):
+        # scale matrix.data by the column sums, sparse result is CSC
+        matrix = csc_matrix(matrix, dtype=float, copy=True)
+        sums = np.asarray(abs(matrix).sum(axis=0)).ravel()
+        sums[sums == 0] = 1
+        matrix.data /= np.repeat(sums, np.diff(matrix.indptr))
+        return matrix
     return sklearn.preprocessing.normalize(matrix, norm="l1", axis=0)
 
 
@@ -86,35 +105,34 @@ def add_self_loops(matrix, loop_value):
     assert shape[0] == shape[1], "Error, matrix is not square"
 
     if isspmatrix(matrix):
-        new_matrix = matrix.todok()
-    else:
-        new_matrix = matrix.copy()
+        # drop the current diagonal and add the new one
+        matrix = csc_matrix(matrix, dtype=float)
+        diag = identity(shape[0], format="csc") * loop_value
+        return (matrix - diags(matrix.diagonal(), format="csc") + diag).tocsc()
 
+    new_matrix = matrix.copy()
     for i in range(shape[0]):
         new_matrix[i, i] = loop_value
 
-    if isspmatrix(matrix):
-        return new_matrix.tocsc()
-
     return new_matrix
 
 
-def prune(matrix, threshold):
+def prune(matrix, threshold, topk=None):
     """
     Prune the matrix so that very small edges are removed.
     The maximum value in each column is never pruned.
 
     :param matrix: The matrix to be pruned
     :param threshold: The value below which edges will be removed
+    :param topk: Keep at most the topk largest values of each column
+                 (sparse matrices only)
     :returns: The pruned matrix
     """
     if isspmatrix(matrix):
-        pruned = dok_matrix(matrix.shape)
-        pruned[matrix >= threshold] = matrix[matrix >= threshold]
-        pruned = pruned.tocsc()
-    else:
-        pruned = matrix.copy()
-        pruned[pruned < threshold] = 0
+        return prune_sparse(matrix, threshold, topk)
+
+    pruned = matrix.copy()
+    pruned[pruned < threshold] = 0
 
     # keep max value in each column. same behaviour for dense/sparse
     num_cols = matrix.shape[1]
@@ -125,6 +143,38 @@ def prune(matrix, threshold):
     return pruned
 
 
+def prune_sparse(matrix, threshold, topk=None):
+    """
+    prune on the data/indices arrays of a CSC matrix
+
+    :param matrix: The sparse matrix to be pruned
+    :param threshold: The value below which edges will be removed
+    :param topk: Keep at most the topk largest values of each column
+    :returns: The pruned CSC matrix
+    """
+    matrix = csc_matrix(matrix, copy=True)
+    matrix.eliminate_zeros()
+    matrix.sort_indices()
+    data, cols = matrix.data, col_ids(matrix)
+    keep = data >= threshold
+    if data.size:
+        # first (lowest row) maximum of every column as matrix.argmax
+        nonempty = np.flatnonzero(np.diff(matrix.indptr))
+        colmax = np.maximum.reduceat(data, matrix.indptr[nonempty])
+        is_max = np.flatnonzero(data == colmax[np.searchsorted(nonempty, cols)])
+        first = np.r_[True, cols[is_max][1:] != cols[is_max][:-1]]
+        if topk:
+            # rank of every value in its column, largest first
+            order = np.lexsort((-data, cols))
+            rank = np.empty(data.size, dtype=np.int64)
+            rank[order] = np.arange(data.size) - matrix.indptr[cols[order]]
+            keep &= rank < topk
+        keep[is_max[first]] = True
+    matrix.data[~keep] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+
 def converged(matrix1, matrix2):
     """
     Check for convergence by determining if
@@ -140,6 +190,19 @@ def converged(matrix1, matrix2):
     return np.allclose(matrix1, matrix2)
 
 
+def column_changed(matrix1, matrix2, rtol=1e-5, atol=1e-8):
+    """
+    Per column version of converged for sparse matrices
+
+    :param matrix1: The sparse matrix to compare with matrix2
+    :param matrix2: The sparse matrix to compare with matrix1
+    :returns: boolean array, True for the columns which are not
+              approximately equal
+    """
+    c = abs(matrix1 - matrix2) - rtol * abs(matrix2)
+    return c.max(axis=0).toarray().ravel() > atol
+
+
 def iterate(matrix, expansion, inflation):
     """
     Run a single iteration (expansion + inflation) of the mcl algorithm
@@ -157,6 +220,90 @@ def iterate(matrix, expansion, inflation):
     return matrix
 
 
+def iterate_blocks(
+    matrix,
+    expansion,
+    inflation,
+    threshold=0,
+    topk=None,
+    workers=1,
+    block_size=None,
+    columns=None,
+):
+    """
+    Run a single iteration (expansion + inflation + pruning) of the mcl
+    algorithm on blocks of columns of a sparse matrix
+    Inflation and pruning only depend on the column, every block is pruned
+    as soon as it is expanded so the full unpruned product is never stored
+
+    :param matrix: The sparse matrix to perform the iteration on
+    :param expansion: Cluster expansion factor
+    :param inflation: Cluster inflation factor
+    :param threshold: Pruning threshold (0 no pruning)
+    :param topk: Keep at most topk values per column when pruning
+    :param workers: Number of threads expanding the blocks
+    :param block_size: Number of columns per block
+    :param columns: Only compute these columns (default all)
+    :returns: The CSC matrix of the next iteration (of columns only)
+    """
+    matrix = csc_matrix(matrix)
+    if columns is None:
+        columns = np.arange(matrix.shape[1])
+    num_cols = len(columns)
+    if not block_size:
+        block_size = -(-num_cols // (4 * workers))
+
+    def block(start):
+        cols = matrix[:, columns[start : start + block_size]]
+        for _ in range(expansion - 1):
+            cols = matrix @ cols
+        cols = inflate(cols, inflation)
+        if threshold > 0:
+            cols = prune(cols, threshold, topk)
+        return cols
+
+    starts = range(0, num_cols, max(1, block_size))
+    if workers > 1:
+        # the sparse products release the GIL
+        with ThreadPoolExecutor(workers) as p:
+            blocks = list(p.map(block, starts))
+    else:
+        blocks = [block(x) for x in starts]
+    return hstack(blocks, format="csc")
+
+
+def iterate_active(matrix, active, expansion, inflation, **kwargs):
+    """
+    Run a single iteration of the mcl algorithm on the active columns of a
+    sparse matrix, the other columns (converged, frozen) are kept as they are
+    A column is active in the next iteration if it changed or if it reads a
+    changed column in the next expansion
+
+    :param matrix: The sparse matrix to perform the iteration on
+    :param active: Indices of the columns to iterate
+    :param expansion: Cluster expansion factor
+    :param inflation: Cluster inflation factor
+    :param kwargs: Passed to iterate_blocks (threshold, topk, workers...)
+    :returns: The CSC matrix of the next iteration, next active columns
+    """
+    matrix = csc_matrix(matrix)
+    num_cols = matrix.shape[1]
+    new = iterate_blocks(matrix, expansion, inflation, columns=active, **kwargs)
+    changed = active[column_changed(new, matrix[:, active])]
+
+    # put the new active columns back in place
+    frozen = np.setdiff1d(np.arange(num_cols), active)
+    order = np.argsort(np.r_[frozen, active])
+    matrix = hstack([matrix[:, frozen], new], format="csc")[:, order]
+
+    # column j reads column r if matrix[r, j] != 0
+    for _ in range(expansion - 1):
+        rows = np.zeros(num_cols, dtype=bool)
+        rows[changed] = True
+        changed = np.union1d(changed, col_ids(matrix)[rows[matrix.indices]])
+    return matrix, changed
+
+
 def get_clusters(matrix):
     """
     Retrieve the clusters from the matrix
@@ -173,13 +320,12 @@ def get_clusters(matrix):
     # get the attractors - non-zero elements of the matrix diagonal
     attractors = matrix.diagonal().nonzero()[0]
 
-    # somewhere to put the clusters
-    clusters = set()
-
     # the nodes in the same row as each attractor form a cluster
-    for attractor in attractors:
-        cluster = tuple(matrix.getrow(attractor).nonzero()[1].tolist())
-        clusters.add(cluster)
+    rows = csr_matrix(matrix)[attractors]
+    rows.eliminate_zeros()
+    rows.sort_indices()
+    members = np.split(rows.indices, rows.indptr[1:-1])
+    clusters = set([tuple(x.tolist()) for x in members])
 
     return sorted(list(clusters))
 
@@ -194,6 +340,10 @@ def run_mcl(
     pruning_frequency=1,
     convergence_check_frequency=1,
     verbose=False,
+    pruning_topk=None,
+    workers=1,
+    block_size=None,
+    freeze=False,
 ):
     """
     Perform MCL on the given similarity matrix
@@ -211,6 +361,13 @@ def run_mcl(
     :param convergence_check_frequency: Perform the check for convergence
            every convergence_check_frequency iterations
     :param verbose: Print extra information to the console
+    :param pruning_topk: Keep at most pruning_topk values per column when
+           pruning a sparse matrix
+    :param workers: Expand a sparse matrix by blocks of columns in workers
+           threads
+    :param block_size: Expand a sparse matrix by blocks of block_size columns
+    :param freeze: Stop iterating the converged columns of a sparse matrix
+           (convergence is then checked on every iteration)
     :returns: The final matrix
     """
     assert expansion > 1, "Invalid expansion parameter"
@@ -242,6 +399,9 @@ def run_mcl(
     )
     printer.print("Maximum iterations: {}".format(iterations))
     printer.print("{} matrix mode".format("Sparse" if isspmatrix(matrix) else "Dense"))
+    freeze = freeze and isspmatrix(matrix)
+    if freeze:
+        printer.print("Freezing converged columns")
     printer.print("-" * 50)
 
     # Initialize self-loops
@@ -251,29 +411,69 @@ def run_mcl(
     # Normalize
     matrix = normalize(matrix)
 
+    blocks = isspmatrix(matrix) and (workers > 1 or block_size)
+    active = np.arange(matrix.shape[1])
+
     # iterations
     for i in range(iterations):
-        printer.print("Iteration {}".format(i + 1))
+        if freeze:
+            printer.print("Iteration {}: {} active columns".format(i + 1, len(active)))
+        else:
+            printer.print("Iteration {}".format(i + 1))
 
         # store current matrix for convergence checking
-        last_mat = matrix.copy()
-
-        # perform MCL expansion and inflation
-        matrix = iterate(matrix, expansion, inflation)
+        # iterations never modify matrix in place
+        last_mat = matrix
+
+        do_prune = pruning_threshold > 0
+        do_prune = do_prune and i % pruning_frequency == pruning_frequency - 1
+        if freeze:
+            # only the columns which changed or read a changed column
+            matrix, active = iterate_active(
+                matrix,
+                active,
+                expansion,
+                inflation,
+                threshold=pruning_threshold if do_prune else 0,
+                topk=pruning_topk,
+                workers=workers,
+                block_size=block_size,
+            )
+            do_prune = False
+        elif blocks:
+            # expansion, inflation and pruning fused by blocks of columns
+            thresh = pruning_threshold if do_prune else 0
+            matrix = iterate_blocks(
+                matrix,
+                expansion,
+                inflation,
+                thresh,
+                pruning_topk,
+                workers,
+                block_size,
+            )
+            do_prune = False
+        else:
+            # perform MCL expansion and inflation
+            matrix = iterate(matrix, expansion, inflation)
 
         # prune
-        if pruning_threshold > 0 and i % pruning_frequency == pruning_frequency - 1:
+        if do_prune:
             printer.print("Pruning")
-            matrix = prune(matrix, pruning_threshold)
+            matrix = prune(matrix, pruning_threshold, pruning_topk)
 
         # Check for convergence
-        if i % convergence_check_frequency == convergence_check_frequency - 1:
+        done = False
+        if freeze:
+            done = not active.size
+        elif i % convergence_check_frequency == convergence_check_frequency - 1:
             printer.print("Checking for convergence")
-            if converged(matrix, last_mat):
-                printer.print(
-                    "Converged after {} iteration{}".format(i + 1, "s" if i > 0 else "")
-                )
-                break
+            done = converged(matrix, last_mat)
+        if done:
+            printer.print(
+                "Converged after {} iteration{}".format(i + 1, "s" if i > 0 else "")
+            )
+            break
 
     printer.print("-" * 50)
     return matrix
@@ -331,30 +531,60 @@ def delta_matrix(matrix, clusters):
     return delta
 
 
+def cluster_indicator(clusters, num_nodes):
+    """
+    Sparse indicator matrix of the clusters, element [i, c] is 1 if node i
+    belongs to cluster c
+
+    :param clusters: The clusters returned by get_clusters
+    :param num_nodes: Number of nodes of the graph
+    :returns: CSR matrix of shape (num_nodes, len(clusters))
+    """
+    sizes = [len(x) for x in clusters]
+    rows = np.fromiter(chain.from_iterable(clusters), dtype=int, count=sum(sizes))
+    cols = np.repeat(np.arange(len(clusters)), sizes)
+    shape = (num_nodes, len(clusters))
+    return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+
+
 def modularity(matrix, clusters):
     """
     Compute the modularity
+    Degrees are computed once and the pairs of nodes in the same cluster are
+    only enumerated over the edges of the graph, O(nnz)
     :param matrix: The adjacency matrix
     :param clusters: The clusters returned by get_clusters
     :returns: modularity value
     """
-    # matrix = convert_to_adjacency_matrix(matrix)
     m = matrix.sum()
-
-    if isspmatrix(matrix):
-        matrix_2 = matrix.tocsr(copy=True)
-    else:
-        matrix_2 = matrix
-
+    out_deg = np.asarray(matrix.sum(axis=1)).ravel()
+    in_deg = np.asarray(matrix.sum(axis=0)).ravel()
     if is_undirected(matrix):
-        expected = lambda i, j: (
-            (matrix_2[i, :].sum() + matrix[:, i].sum())
-            * (matrix[:, j].sum() + matrix_2[j, :].sum())
-        )
+        out_deg = in_deg = out_deg + in_deg
+
+    indicator = cluster_indicator(clusters, matrix.shape[0])
+    member = np.asarray(indicator.sum(axis=1)).ravel()
+    if (member > 1).any():
+        # overlapping clusters, a pair sharing several clusters counts once
+        delta = (indicator @ indicator.T).tocoo()
+        i, j = delta.row[delta.row != delta.col], delta.col[delta.row != delta.col]
+        observed = np.asarray(matrix[i, j]).sum()
+        expected = np.dot(out_deg[i], in_deg[j])
     else:
-        expected = lambda i, j: (matrix_2[i, :].sum() * matrix[:, j].sum())
-
-    delta = delta_matrix(matrix, clusters)
-    indices = np.array(delta.nonzero())
-    Q = sum(matrix[i, j] - expected(i, j) / m for i, j in indices.T) / m
+        # edges within a cluster, label -1 = node in no cluster
+        label = np.full(matrix.shape[0], -1)
+        nodes = np.repeat(np.arange(matrix.shape[0]), np.diff(indicator.indptr))
+        label[nodes] = indicator.indices
+        if isspmatrix(matrix):
+            edges = matrix.tocoo()
+            i, j, w = edges.row, edges.col, edges.data
+        else:
+            i, j = np.nonzero(matrix)
+            w = matrix[i, j]
+        same = (label[i] == label[j]) & (label[i] >= 0) & (i != j)
+        observed = w[same].sum()
+        # all ordered pairs of a cluster minus the pairs i == i
+        expected = np.dot(indicator.T @ out_deg, indicator.T @ in_deg)
+        expected -= np.dot(out_deg[member > 0], in_deg[member > 0])
+    Q = (observed - expected / m) / m
     return Q
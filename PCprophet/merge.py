@@ -3,6 +3,7 @@ import sys
 import pandas as pd
 
 import PCprophet.io_ as io
+import PCprophet.perf as perf
 
 
 def split_delim(dels):
@@ -11,13 +12,20 @@ def split_delim(dels):
     return "#".join(x_)
 
 
+def select_cols(df, cols):
+    """
+    select cols in order, FT is missing when profiles are in io.ProfileStore
+    """
+    return df[[x for x in cols if x in df]]
+
+
 def combined_hyp(base):
     #  base = io.resource_path(base)
-    hypo = pd.read_csv(os.path.join(base, "hypo.txt"), sep="\t")
+    hypo = io.read_table(io.tmp_file(base, "hypo"))
     hypo["ANN"] = 0
     hypo["CMPLT"] = 0
-    hypo = hypo[["ID", "CMPLT", "MB", "FT", "ANN"]]
-    cor = pd.read_csv(os.path.join(base, "ann_cmplx.txt"), sep="\t")
+    hypo = select_cols(hypo, ["ID", "CMPLT", "MB", "FT", "ANN"])
+    cor = io.read_table(io.tmp_file(base, "ann_cmplx"))
     cor["ANN"] = 1
     assert list(hypo) == list(cor)
     combined = pd.concat([hypo, cor])
@@ -29,23 +37,24 @@ def combined_hyp(base):
     #     .reset_index()
     # )
     combined.drop_duplicates(subset=['MB'], keep='first', inplace=True)
-    combined = combined[["ID", "MB", "FT", "ANN", "CMPLT"]]
+    combined = select_cols(combined, ["ID", "MB", "FT", "ANN", "CMPLT"])
     return combined
 
 
 def corum(base):
     #  base = io.resource_path(base)
-    cor = pd.read_csv(os.path.join(base, "ann_cmplx.txt"), sep="\t")
+    cor = io.read_table(io.tmp_file(base, "ann_cmplx"))
     cor["ANN"] = 1
-    combined = cor[["ID", "MB", "FT", "ANN", "CMPLT"]]
+    combined = select_cols(cor, ["ID", "MB", "FT", "ANN", "CMPLT"])
     return combined
 
 
-def runner(base, mergemode):
+def runner(base, mergemode, fmt="txt"):
     """
     get both hypothesis and annotated complexes and merge them in single file
     before prediction
     argv[1] = tmp/filename
+    fmt = format of the tmp files (txt or npz)
     """
     # need to reformat both
     combined = pd.DataFrame()
@@ -55,6 +64,7 @@ def runner(base, mergemode):
     elif mergemode == "reference":
         combined = corum(base)
         print("using only corum annotated complexes for " + base)
-    outpath = os.path.join(base, "cmplx_combined.txt")
-    combined.to_csv(outpath, sep="\t", index=False)
+    perf.count(complexes_out=combined.shape[0])
+    outpath = io.tmp_file(base, "cmplx_combined", fmt)
+    io.write_table(combined, outpath)
     return True
@@ -0,0 +1,76 @@
+import os
+
+import PCprophet.io_ as io
+import PCprophet.perf as perf
+import PCprophet.stats_ as st
+
+
+# standardize and center methods
+def center_arr(hoa, fr_nr="all", smooth=True, stretch=(True, 72), resc=True):
+    """
+    normalize all profiles at once with st.norm_profiles
+    proteins with less than 2 real values are dropped
+    """
+    if not hoa:
+        return {}
+    ids = list(hoa.keys())
+    keep, mat = st.norm_profiles(
+        [hoa[k] for k in ids], fr_nr=fr_nr, smooth=smooth, stretch=stretch, resc=resc
+    )
+    ids = [k for k, x in zip(ids, keep) if x]
+    return dict(zip(ids, mat.tolist()))
+
+
+def get_stores(base):
+    """
+    normalized and raw (resampled only) profile stores of a sample
+    """
+    return io.ProfileStore(base, "profiles"), io.ProfileStore(base, "raw_profiles")
+
+
+def fr_path(base):
+    """
+    fractions used for the normalization of the stores in base
+    """
+    return os.path.join(base, "profiles_fr.txt")
+
+
+def read_fr(base):
+    if not os.path.isfile(fr_path(base)):
+        return None
+    with open(fr_path(base), "r") as infile:
+        return infile.read().strip()
+
+
+def load(infile, use_fr="all"):
+    """
+    normalized and raw stores of infile, normalized here if missing or
+    normalized with other fractions than use_fr
+    """
+    base = io.file2folder(infile, prefix="./tmp/")
+    norm, raw = get_stores(base)
+    if not (norm.exists() and raw.exists()) or read_fr(base) != str(use_fr):
+        runner(infile, use_fr)
+    return norm.load(), raw.load()
+
+
+def runner(infile, use_fr):
+    """
+    read infile once and write the profiles used by all the other stages
+    profiles = smoothed, resampled to 72 fractions and rescaled
+    raw_profiles = only resampled to 72 fractions (for differential)
+    """
+    prot = io.read_txt(infile)
+    print("normalizing " + infile)
+    base = io.file2folder(infile, prefix="./tmp/")
+    os.makedirs(base, exist_ok=True)
+    # stretch raw to assert same length
+    raw = center_arr(prot, stretch=(True, 72), smooth=False, resc=False)
+    norm = center_arr(prot, fr_nr=use_fr, stretch=(True, 72))
+    norm_store, raw_store = get_stores(base)
+    norm_store.write(norm)
+    raw_store.write(raw)
+    with open(fr_path(base), "w") as outfile:
+        outfile.write(str(use_fr) + "\n")
+    perf.count(proteins_in=len(prot), proteins_out=len(norm))
+    return True
@@ -119,26 +119,16 @@ def read_gaf_out(go_path):
     gn => c
        => mf
        => bp
+    multiple rows for the same gene are ; joined
+    every entry starts with a placeholder term outside the GO graph
+    this keeps the scores identical to the previous line based reader
+    plain dicts, the hash is shared by all stages and must not grow on lookup
     """
-    out = io.makedeephash()
-    header = []
-    temp = {}
-    for line in open(go_path, mode="r"):
-        line = line.rstrip("\n")
-        if line.startswith(str("ID") + "\t"):
-            header = re.split(r"\t+", line)
-        else:
-            things = re.split(r"\t+", line)
-            temp = dict(zip(header, things))
-        if len(temp.keys()) > 0:
-            pr = str.upper(temp["GN"])
-            for k in temp.keys():
-                # if the key is the same
-                if out[pr][k] and k is not "ID" or "GN":
-                    out[pr][k] = ";".join([str(out[pr][k]), temp[k]])
-                elif k is not "ID" or "GN":
-                    out[pr][k] = temp[k]
-    return out
+    df = io.read_tab(go_path)
+    gn = df["GN"].str.upper()
+    nonempty = lambda x: ";".join(["none"] + [y for y in x if y])
+    joined = df.groupby(gn, sort=False).agg(nonempty)
+    return dict(zip(joined.index, joined.to_dict("records")))
 
 
 def s_values(G, term):
@@ -191,7 +181,7 @@ def parse_go(gn, gaf, go_type):
     """
     tmp = []
     try:
-        tmp = gaf[gn][go_type].split(";")
+        tmp = gaf.get(gn, {}).get(go_type).split(";")
     except AttributeError as e:
         tmp.append("NA")
     tmp = list(set(tmp))
@@ -0,0 +1,210 @@
+# !/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+_LOCAL = threading.local()
+# stages running in this process, to know if the process cpu time is theirs
+_ACTIVE = set()
+_ACTIVE_LOCK = threading.Lock()
+PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else None
+
+
+def peak_rss(who="self"):
+    """
+    peak resident memory in MB (None if not available) over the whole life
+    of the process (who="self") or of its largest terminated child process
+    (who="children")
+    """
+    if resource is None:
+        return None
+    rss = usage(who).ru_maxrss
+    # bytes on macOS, kB elsewhere
+    div = 2**20 if sys.platform == "darwin" else 2**10
+    return round(rss / div, 1)
+
+
+def usage(who="self"):
+    flag = resource.RUSAGE_CHILDREN if who == "children" else resource.RUSAGE_SELF
+    return resource.getrusage(flag)
+
+
+def current_rss():
+    """
+    resident memory of the process in MB (None if not available, linux only)
+    """
+    try:
+        with open("/proc/self/statm", "r") as infile:
+            pages = int(infile.read().split()[1])
+    except (OSError, ValueError, IndexError, TypeError):
+        return None
+    return round(pages * PAGE / 2**20, 1)
+
+
+class RssSampler(threading.Thread):
+    """
+    docstring for RssSampler
+    keeps the highest resident memory of the process seen until stop()
+    """
+
+    def __init__(self, every=0.05):
+        super(RssSampler, self).__init__(daemon=True)
+        self.every = every
+        self.done = threading.Event()
+        self.peak = current_rss()
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def run(self):
+        while not self.done.wait(self.every):
+            self.sample()
+
+    def stop(self):
+        self.done.set()
+        self.sample()
+        return self.peak
+
+
+def children_cpu():
+    """
+    cpu time of the terminated child processes (worker pools) in s
+    """
+    if resource is None:
+        return 0
+    ru = usage("children")
+    return ru.ru_utime + ru.ru_stime
+
+
+def count(**kwargs):
+    """
+    add row counts (proteins_in=10, complexes_out=2) to the stage running
+    in this thread, does nothing outside of a stage
+    """
+    rec = getattr(_LOCAL, "rec", None)
+    if rec is None:
+        return False
+    for k, v in kwargs.items():
+        rec["rows"][k] = rec["rows"].get(k, 0) + int(v)
+    return True
+
+
+class Stage(object):
+    """
+    docstring for Stage
+    context manager timing a single stage of a run
+    wall time, cpu time (cpu_s) and the worker processes which ended during
+    the stage (children_cpu_s), peak RSS of the process sampled while the
+    stage runs and the row counts given to count()
+    cpu_s is the process time if no other stage ran meanwhile, else only
+    the time of the stage thread (cpu_scope), children and RSS are counted
+    per process so stages running concurrently in threads share them
+    """
+
+    def __init__(self, report, name, sample=None):
+        super(Stage, self).__init__()
+        self.report = report
+        self.rec = {"stage": name, "sample": sample, "rows": {}}
+        self.prev = None
+        self.wall = None
+        self.cpu = None
+        self.children = None
+        self.proc = None
+        self.rss = None
+        self.shared = False
+
+    def __enter__(self):
+        self.prev = getattr(_LOCAL, "rec", None)
+        _LOCAL.rec = self.rec
+        with _ACTIVE_LOCK:
+            for x in _ACTIVE:
+                x.shared = True
+            self.shared = bool(_ACTIVE)
+            _ACTIVE.add(self)
+        self.rss = RssSampler()
+        self.rss.start()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.proc = time.process_time()
+        self.children = children_cpu()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.rec["wall_s"] = round(time.perf_counter() - self.wall, 3)
+        cpu = time.thread_time() - self.cpu
+        proc = time.process_time() - self.proc
+        with _ACTIVE_LOCK:
+            _ACTIVE.discard(self)
+        self.rec["cpu_s"] = round(cpu if self.shared else proc, 3)
+        self.rec["cpu_scope"] = "thread" if self.shared else "process"
+        self.rec["children_cpu_s"] = round(children_cpu() - self.children, 3)
+        self.rec["peak_rss_mb"] = self.rss.stop()
+        self.rec["ok"] = exc_type is None
+        _LOCAL.rec = self.prev
+        self.report.add(self.rec)
+        return False
+
+
+class PerfReport(object):
+    """
+    docstring for PerfReport
+    collects the Stage records of a run and writes them as json
+    """
+
+    def __init__(self):
+        super(PerfReport, self).__init__()
+        self.stages = []
+        self.lock = threading.Lock()
+        self.start = datetime.now()
+        self.wall = time.perf_counter()
+
+    def stage(self, name, sample=None):
+        return Stage(self, name, sample)
+
+    def add(self, rec):
+        with self.lock:
+            self.stages.append(rec)
+
+    def summary(self):
+        """
+        total wall and cpu time per stage across samples
+        """
+        out = {}
+        times = ["wall_s", "cpu_s", "children_cpu_s"]
+        for rec in self.stages:
+            tot = out.setdefault(rec["stage"], dict({"n": 0}, **{x: 0 for x in times}))
+            tot["n"] += 1
+            for x in times:
+                tot[x] = round(tot[x] + rec.get(x, 0), 3)
+        return out
+
+    def write(self, path="ProphetPerf.json"):
+        report = {
+            "start": self.start.isoformat(timespec="seconds"),
+            "wall_s": round(time.perf_counter() - self.wall, 3),
+            # over the whole run, not per stage
+            "peak_rss_mb": peak_rss(),
+            "children_peak_rss_mb": peak_rss("children"),
+            "summary": self.summary(),
+            "stages": self.stages,
+        }
+        with open(path, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+        return True
+
+
+# report of the current run
+REPORT = PerfReport()
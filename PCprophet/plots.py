@@ -4,6 +4,7 @@ import networkx as nx
 import pandas as pd
 import numpy as np
 
+import PCprophet.io_ as io
 import PCprophet.stats_ as st
 
 
@@ -33,7 +34,7 @@ def plot_positive(comb, sid, pl_dir):
         return st.renormalize(row["SEL"], (0, 71), (0, fr - 1))
 
     sa_id = pd.read_csv(sid, sep="\t", index_col=False)
-    comb = pd.read_csv(comb, sep="\t", index_col=False)
+    comb = io.read_csv(comb, sep="\t", index_col=False)
 
     # remove columns with single protein ID
     comb = comb[comb["ID"] != comb["CMPLX"]]
@@ -256,5 +257,5 @@ def runner(tmp_fold, out_fold, target_fdr, sid):
         plot_recall(out_fold)
     except Exception as e:
         pass
-    comb = os.path.join(tmp_fold, "combined.txt")
+    comb = io.tmp_file(tmp_fold, "combined")
     plot_positive(comb, sid, pl_dir=outf)
@@ -9,13 +9,15 @@ from sklearn.ensemble import RandomForestClassifier
 import joblib
 
 import PCprophet.io_ as io
+import PCprophet.perf as perf
+import PCprophet.resource_cache as cache
 
 
 def deserialize(model):
     """
     return model
     """
-    clf = joblib.load(model)
+    clf = cache.model(model)
     return clf
 
 
@@ -27,19 +29,24 @@ def test_model():
 
 
 # old rf_equal.clf
-def runner(base, model="./PCprophet/rf_allneg.clf"):
+def runner(base, model="./PCprophet/rf_allneg.clf", fmt="txt"):
     """
     get model file and run prediction
+    fmt = format of the tmp files (txt or npz)
     """
-    infile = os.path.join(base, "mp_feat_norm.txt")
-    X, memo = io.prepare_feat(infile)
+    feat = io.FeatureMatrix(base)
+    if feat.exists():
+        feat.load()
+        X, memo = feat.mat, np.array(feat.names, dtype=object)[:, None]
+    else:
+        X, memo = io.prepare_feat(io.tmp_file(base, "mp_feat_norm"))
     clf = deserialize(model)
     prob = np.array(clf.predict_proba(X))
     pos = np.array(["Yes" if x == 1 else "No" for x in clf.predict(X)])
-    out = np.concatenate((memo, prob, pos.reshape(-1, 1)), axis=1)
-    header = ["ID", "NEG", "POS", "IS_CMPLX"]
-    df = pd.DataFrame(out, columns=header)
-    df = df[["ID", "POS", "NEG", "IS_CMPLX"]]
-    outfile = os.path.join(base, "rf.txt")
-    df.to_csv(outfile, sep="\t", index=False)
+    perf.count(complexes_in=X.shape[0], positive_out=(pos == "Yes").sum())
+    df = pd.DataFrame(
+        {"ID": memo[:, 0], "POS": prob[:, 1], "NEG": prob[:, 0], "IS_CMPLX": pos}
+    )
+    outfile = io.tmp_file(base, "rf", fmt)
+    io.write_table(df, outfile)
     return True
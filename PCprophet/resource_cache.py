@@ -0,0 +1,219 @@
+# !/usr/bin/env python3
+
+import os
+import hashlib
+import pickle
+import tempfile
+import uuid
+import threading
+import joblib
+
+import PCprophet.io_ as io
+import PCprophet.parse_go as go
+
+# parsed resources are pickled here, one file per resource content
+# set by -cache_dir, else CACHE_ENV or the first writable default (cache_dir)
+CACHE_DIR = None
+CACHE_ENV = "PCPROPHET_CACHE"
+# bump when a parser or a pickled class changes, older pickles are ignored
+CACHE_VERSION = 1
+
+# loaded resources of this process, shared by the sample threads
+_LOADED = {}
+_HASHES = {}
+_LOCK = threading.RLock()
+# derived files computed for this run only when the cache is not writable
+_RUN_DIR = []
+
+
+def set_cache_dir(path):
+    global CACHE_DIR
+    CACHE_DIR = None if path in [None, "None"] else path
+    return CACHE_DIR
+
+
+def writable(path):
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(path, os.W_OK)
+
+
+def cache_dir():
+    """
+    -cache_dir, CACHE_ENV or the package cache folder if writable, else the
+    user cache or the temporary folder
+    """
+    if CACHE_DIR:
+        return CACHE_DIR
+    if os.environ.get(CACHE_ENV):
+        return os.environ[CACHE_ENV]
+    home = os.path.join(os.path.expanduser("~"), ".cache")
+    dirs = [
+        io.resource_path("cache"),
+        os.path.join(os.environ.get("XDG_CACHE_HOME", home), "PCprophet"),
+        os.path.join(tempfile.gettempdir(), "PCprophet_cache"),
+    ]
+    return next((x for x in dirs if writable(x)), dirs[-1])
+
+
+def run_dir():
+    if not _RUN_DIR:
+        _RUN_DIR.append(tempfile.mkdtemp(prefix="PCprophet_"))
+    return _RUN_DIR[0]
+
+
+def file_hash(path, block=2**20):
+    """
+    sha1 of the file content
+    memoized on path, size and modification time
+    """
+    st = os.stat(path)
+    stamp = (os.path.realpath(path), st.st_size, st.st_mtime)
+    if stamp not in _HASHES:
+        sha = hashlib.sha1()
+        with open(path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(block), b""):
+                sha.update(chunk)
+        _HASHES[stamp] = sha.hexdigest()
+    return _HASHES[stamp]
+
+
+def read_pickle(path):
+    try:
+        with open(path, "rb") as infile:
+            return pickle.load(infile)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        return None
+
+
+def write_pickle(obj, path):
+    """
+    write to a temporary file and rename it so concurrent readers never
+    see a partial cache entry
+    """
+    tmp = "{}.{}".format(path, uuid.uuid4().hex)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as outfile:
+            pickle.dump(obj, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def cache_key(path, kind):
+    return "_".join([kind, "v{}".format(CACHE_VERSION), file_hash(path)])
+
+
+def load(path, kind, parser, pack=None, unpack=None, disk=True):
+    """
+    parse path once and return the shared instance
+    kind names the resource, the key is kind, CACHE_VERSION and the file hash
+    pack/unpack convert the parsed object to and from its pickled form
+    disk=False only keeps the object in memory (i.e already binary files)
+    """
+    with _LOCK:
+        key = cache_key(path, kind)
+        if key in _LOADED:
+            return _LOADED[key]
+        dest = os.path.join(cache_dir(), key + ".pkl")
+        obj = read_pickle(dest) if disk else None
+        if obj is None:
+            obj = parser(path)
+            if disk:
+                write_pickle(pack(obj) if pack else obj, dest)
+        elif unpack:
+            obj = unpack(obj)
+        _LOADED[key] = obj
+        return obj
+
+
+def derived_path(path, kind, ext="txt"):
+    """
+    path in the cache of the file derived from path (see derived)
+    """
+    key = "_".join([kind, file_hash(path)])
+    return os.path.join(cache_dir(), ".".join([key, ext]))
+
+
+def write_derived(path, writer, dest):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    # samples in other processes only ever see a complete file
+    tmp = "{}.{}".format(dest, uuid.uuid4().hex)
+    try:
+        writer(path, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+    return dest
+
+
+def derived(path, kind, writer, ext="txt"):
+    """
+    file computed from path by writer(path, dest) once per content of path
+    kind names the derived file and its parameters
+    returns the path of the derived file in the cache, or in a temporary
+    folder of this run if the cache is not writable
+    """
+    with _LOCK:
+        dest = derived_path(path, kind, ext)
+        if os.path.isfile(dest):
+            return dest
+        try:
+            return write_derived(path, writer, dest)
+        except OSError:
+            dest = os.path.join(run_dir(), os.path.basename(dest))
+            if os.path.isfile(dest):
+                return dest
+            return write_derived(path, writer, dest)
+
+
+def go_dag(path):
+    """
+    GO graph from the obo file
+    """
+    return load(path, "obo", go.from_obo)
+
+
+def gaf(path):
+    """
+    gene name => CC/MF/BP terms from the gaf derived file
+    """
+    return load(path, "gaf", go.read_gaf_out)
+
+
+def model(path):
+    """
+    deserialized classifier
+    """
+    return load(path, "clf", joblib.load, disk=False)
+
+
+def complex_db(path):
+    """
+    compiled complex database (io.ComplexIndex)
+    """
+    return load(path, "cmplx_db", io.read_complex_db)
+
+
+def table(path):
+    """
+    tab delimited resource table as DataFrame
+    """
+    return load(path, "tab", lambda x: io.read_csv(x, sep="\t"))
+
+
+def warm(config):
+    """
+    load the resources used by all samples before the workers are started
+    """
+    go_dag(io.resource_path(config["GLOBAL"]["go_obo"]))
+    gaf(io.resource_path(config["GLOBAL"]["sp_go"]))
+    model(io.resource_path("rf_allneg.clf"))
+    return True
@@ -0,0 +1,180 @@
+# !/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import threading
+import uuid
+
+import PCprophet.perf as perf
+from PCprophet.resource_cache import file_hash
+
+# bump when a code change makes the existing tmp files invalid
+VERSION = 3
+
+# stage graph of a run, stage => stages it reads from
+# the sample stages run once per sample, the others once per run
+SAMPLE_STAGES = [
+    "normalize",
+    "map_to_database",
+    "hypothesis",
+    "merge",
+    "generate_features",
+    "predict",
+]
+GLOBAL_STAGES = ["collapse", "differential", "plots"]
+STAGES = SAMPLE_STAGES + GLOBAL_STAGES
+DEPENDS = {
+    "normalize": [],
+    "map_to_database": ["normalize"],
+    "hypothesis": ["normalize"],
+    "merge": ["map_to_database", "hypothesis"],
+    "generate_features": ["merge"],
+    "predict": ["generate_features"],
+    "collapse": ["predict"],
+    "differential": ["collapse"],
+    "plots": ["collapse", "differential"],
+}
+
+# arguments which do not change the output of a stage
+NO_KEY = ["workers"]
+
+
+def downstream(stage):
+    """
+    stage and all the stages depending on it
+    """
+    out = {stage}
+    for x in STAGES:
+        if any([y in out for y in DEPENDS[x]]):
+            out.add(x)
+    return out
+
+
+def waves(stages):
+    """
+    split stages in groups which only depend on the previous groups
+    the stages of a group can run concurrently
+    """
+    out = []
+    done = set()
+    todo = list(stages)
+    while todo:
+        wave = [x for x in todo if all([y in done for y in DEPENDS[x] if y in stages])]
+        out.append(wave)
+        done.update(wave)
+        todo = [x for x in todo if x not in done]
+    return out
+
+
+def get_plan(resume_from="None", only="None"):
+    """
+    what to do for every stage
+    skip = do not run, force = run even if up to date, cache = run if needed
+    """
+    if only != "None":
+        return {x: "force" if x == only else "skip" for x in STAGES}
+    elif resume_from != "None":
+        todo = downstream(resume_from)
+        return {x: "force" if x in todo else "skip" for x in STAGES}
+    return {x: "cache" for x in STAGES}
+
+
+class StageCache(object):
+    """
+    docstring for StageCache
+    manifest (stages.json) of the stages completed in a tmp folder
+    a stage is keyed on the content of its input files and on its arguments
+    and is skipped as long as the key and all its outputs are unchanged
+    """
+
+    def __init__(self, base, use="True", plan=None, name="stages.json"):
+        super(StageCache, self).__init__()
+        self.base = base
+        self.use = use == "True"
+        self.plan = plan if plan else {}
+        self.path = os.path.join(base, name)
+        self.stages = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as infile:
+                    self.stages = json.load(infile)
+            except ValueError:
+                self.stages = {}
+
+    def key(self, inputs, params):
+        """
+        hash of the input files content and of the stage arguments
+        """
+        sha = hashlib.sha1(str(VERSION).encode())
+        for x in inputs:
+            sha.update((file_hash(x) if os.path.isfile(x) else "-").encode())
+        for k in sorted(set(params) - set(NO_KEY)):
+            sha.update("{}={};".format(k, params[k]).encode())
+        return sha.hexdigest()
+
+    def outputs(self, names):
+        """
+        files in base written by a stage (any format or index of names)
+        plus the existing files given as absolute paths
+        """
+        out = [x for x in names if os.path.isabs(x) and os.path.isfile(x)]
+        if os.path.isdir(self.base):
+            fl = sorted(os.listdir(self.base))
+            out.extend([x for x in fl if x.split(".")[0] in names])
+        return out
+
+    def stamp(self, fl):
+        st = os.stat(os.path.join(self.base, fl))
+        return [st.st_size, st.st_mtime]
+
+    def is_valid(self, stage, key):
+        rec = self.stages.get(stage)
+        if not rec or rec["key"] != key:
+            return False
+        for fl, (sha, stamp) in rec["outputs"].items():
+            path = os.path.join(self.base, fl)
+            if not os.path.isfile(path):
+                return False
+            # only rehash files touched since the stage was run
+            if self.stamp(fl) != stamp and file_hash(path) != sha:
+                return False
+        return True
+
+    def done(self, stage, key, names):
+        out = {}
+        for fl in self.outputs(names):
+            out[fl] = [file_hash(os.path.join(self.base, fl)), self.stamp(fl)]
+        # stages of the same wave finish concurrently
+        with self.lock:
+            self.stages[stage] = {"key": key, "outputs": out}
+            tmp = "{}.{}".format(self.path, uuid.uuid4().hex)
+            with open(tmp, "w") as outfile:
+                json.dump(self.stages, outfile, indent=2)
+            os.replace(tmp, self.path)
+        return True
+
+    def run(self, stage, func, inputs, outputs, **kwargs):
+        """
+        run func(**kwargs) unless a valid result for the same key exists
+        inputs are the files read by the stage, outputs the tmp names written
+        (or absolute paths for files outside of base)
+        inputs can be a callable, resolved when the stage runs (i.e. tmp files
+        whose format is only known once the previous stage wrote them)
+        """
+        todo = self.plan.get(stage, "cache")
+        if todo == "skip":
+            print("{} skipped for {}".format(stage, self.base))
+            perf.count(skipped=1)
+            return True
+        if callable(inputs):
+            inputs = inputs()
+        key = self.key(inputs, kwargs)
+        if todo == "cache" and self.use and self.is_valid(stage, key):
+            print("{} up to date for {}".format(stage, self.base))
+            perf.count(cached=1)
+            return True
+        res = func(**kwargs)
+        self.done(stage, key, outputs)
+        return res
@@ -148,6 +148,84 @@ def impute_namean(ls):
     return ls
 
 
+# matrix versions, one protein profile per row
+def gauss_filter_mat(mat, sigma=1, order=0):
+    """
+    gaussian filtering of every row
+    """
+    return image.gaussian_filter1d(mat, sigma=sigma, order=order, axis=1)
+
+
+def impute_namean_mat(mat):
+    """
+    impute_namean for every row
+    an imputed 0 has two non 0 neighbours so imputations never chain
+    """
+    out = mat.copy()
+    inner = mat[:, 1:-1]
+    left, right = mat[:, :-2], mat[:, 2:]
+    fill = (inner == 0) & (left != 0) & (right != 0)
+    out[:, 1:-1][fill] = ((left + right) / 2)[fill]
+    return out
+
+
+def resample_mat(mat, output_fr):
+    """
+    linear interpolation of every row to output_fr points (same as resample)
+    the interpolation indexes and weights are computed once for all rows
+    """
+    input_fr = mat.shape[1]
+    if input_fr < 2:
+        return np.repeat(mat[:, :1], output_fr, axis=1)
+    x = np.linspace(0.0, 1.0, output_fr, endpoint=False)
+    xp = np.linspace(0.0, 1.0, input_fr, endpoint=False)
+    j = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, input_fr - 2)
+    slope = (mat[:, j + 1] - mat[:, j]) / (xp[j + 1] - xp[j])
+    out = slope * (x - xp[j]) + mat[:, j]
+    # points on xp and after the last xp take the value as in np.interp
+    exact = x == xp[j]
+    out[:, exact] = mat[:, j[exact]]
+    out[:, x >= xp[-1]] = mat[:, -1:]
+    return out
+
+
+def resize_mat(mat, lower=0, upper=1.0):
+    """
+    rescale every row from 1 to 0, flat rows are set to 0
+    """
+    mn = mat.min(axis=1, keepdims=True)
+    rng = mat.max(axis=1, keepdims=True) - mn
+    flat = (rng == 0).ravel()
+    rng[flat] = 1
+    out = ((mat - mn) / rng) * (upper - lower) + lower
+    out[flat] = 0
+    return out
+
+
+def norm_profiles(mat, fr_nr="all", smooth=True, stretch=(True, 72), resc=True):
+    """
+    normalize a protein x fraction matrix
+    first fr_nr fractions, gaussian smoothing, imputation of single missing
+    fractions, resampling to stretch[1] fractions and rescaling to 0-1
+    returns the mask of the rows kept (at least 2 values > 0) and the matrix
+    """
+    mat = np.asarray(mat, dtype=float)
+    if fr_nr != "all":
+        mat = mat[:, : int(fr_nr)]
+    keep = (mat > 0).sum(axis=1) >= 2
+    mat = mat[keep]
+    if mat.shape[0] == 0:
+        return keep, mat
+    if smooth:
+        mat = gauss_filter_mat(mat, sigma=1, order=0)
+    mat = impute_namean_mat(mat)
+    if stretch[0]:
+        mat = resample_mat(mat, stretch[1])
+    if resc:
+        mat = resize_mat(mat)
+    return keep, mat
+
+
 def fwhm(y, frac=2):
     """
     calculate full width half max of peak within two fractions
@@ -1,4 +1,5 @@
 import PCprophet.exceptions as PCpexc
+import PCprophet.io_ as io
 import pandas as pd
 
 
@@ -16,7 +17,7 @@ class InputTester(object):
         self.path = path
 
     def read_infile(self):
-        self.infile = pd.read_csv(self.path, sep="\t", index_col=False)
+        self.infile = io.read_csv(self.path, sep="\t", index_col=False)
 
     def test_missing_col(self, col):
         """
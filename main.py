@@ -5,7 +5,8 @@ import configparser
 import sys
 import os
 import platform
-import multiprocessing.dummy as mult_proc
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import partial
 import numpy as np
 
@@ -17,11 +18,16 @@ from PCprophet import generate_features as generate_features
 from PCprophet import hypothesis as hypothesis
 from PCprophet import map_to_database as map_to_database
 from PCprophet import merge as merge
+from PCprophet import normalize as normalize
 from PCprophet import differential as differential
+from PCprophet import perf as perf
 from PCprophet import predict as predict
+from PCprophet import resource_cache as resource_cache
+from PCprophet import stage_cache as stage_cache
 from PCprophet import plots as plots
 
 from PCprophet import validate_input as validate
+from PCprophet.exceptions import SampleError
 
 
 class ParserHelper(argparse.ArgumentParser):
@@ -86,6 +92,21 @@ def create_config():
         default="False",
         choices=["True", "False"],
     )
+    parser.add_argument(
+        "-ppi_score",
+        help="score column of the ppi network (None = all edges have weight 1)",
+        dest="ppi_score",
+        action="store",
+        default="None",
+    )
+    parser.add_argument(
+        "-ppi_thresh",
+        help="minimum score of the ppi edges, requires -ppi_score",
+        dest="ppi_thresh",
+        action="store",
+        default=0,
+        type=float,
+    )
     parser.add_argument(
         "-a",
         help="use all fractions [1,X]",
@@ -133,9 +154,94 @@ def create_config():
         default="True",
         choices=["True", "False"],
     )
+    parser.add_argument(
+        "-workers",
+        help="number of sample processes (0 = one per sample up to the CPU count)",
+        dest="workers",
+        action="store",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "-feat_workers",
+        help="processes scoring the complexes of a sample (0 = share the CPUs)",
+        dest="feat_workers",
+        action="store",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "-tmp_fmt",
+        help="format of the intermediate files in tmp (npz is binary)",
+        dest="tmp_fmt",
+        action="store",
+        default="txt",
+        choices=["txt", "npz"],
+    )
+    parser.add_argument(
+        "-prof_store",
+        help="complexes use the sample profile store instead of an FT column",
+        dest="prof_store",
+        action="store",
+        default="False",
+        choices=["True", "False"],
+    )
+    parser.add_argument(
+        "-tmp_compress",
+        help="compress the text files in tmp (inputs are detected automatically)",
+        dest="tmp_compress",
+        action="store",
+        default="False",
+        choices=["False", "gzip", "zstd"],
+    )
+    parser.add_argument(
+        "-feat_export",
+        help="also write the classifier features to mp_feat_norm",
+        dest="feat_export",
+        action="store",
+        default="False",
+        choices=["True", "False"],
+    )
+    parser.add_argument(
+        "-stage_cache",
+        help="skip the sample stages whose inputs and options did not change",
+        dest="stage_cache",
+        action="store",
+        default="True",
+        choices=["True", "False"],
+    )
+    parser.add_argument(
+        "-resume_from",
+        help="run this stage and all the stages depending on it, skip the others",
+        dest="resume_from",
+        action="store",
+        default="None",
+        choices=["None"] + stage_cache.STAGES,
+    )
+    parser.add_argument(
+        "-only",
+        help="run only this stage",
+        dest="only",
+        action="store",
+        default="None",
+        choices=["None"] + stage_cache.STAGES,
+    )
+    parser.add_argument(
+        "-cache_dir",
+        help="folder of the parsed resources and clustered networks cache "
+        "(None = PCprophet/cache or if not writable the user cache)",
+        dest="cache_dir",
+        action="store",
+        default="None",
+    )
     parser.add_argument("-w", dest="weight_pred", action="store", default=1, type=float)
     parser.add_argument("-v", dest="verbose", action="store", default=0)
     args = parser.parse_args()
+    # fail before any sample is processed
+    if args.tmp_compress == "zstd" and io.zstandard is None:
+        parser.error("-tmp_compress zstd requires the zstandard package")
+    if args.ppi_thresh != 0 and args.ppi_score == "None":
+        parser.error("-ppi_thresh requires -ppi_score")
 
     # deal with numpy warnings and so on
     if args.verbose == 0:
@@ -156,9 +262,21 @@ def create_config():
         "mw": args.mwuni,
         "temp": r"./tmp",
         "mult": args.multi,
+        "workers": args.workers,
+        "feat_workers": args.feat_workers,
+        "tmp_fmt": args.tmp_fmt,
+        "prof_store": args.prof_store,
+        "tmp_compress": args.tmp_compress,
+        "feat_export": args.feat_export,
+        "stage_cache": args.stage_cache,
+        "resume_from": args.resume_from,
+        "only": args.only,
+        "cache_dir": args.cache_dir,
     }
     config["PREPROCESS"] = {
         "is_ppi": args.is_ppi,
+        "ppi_score": args.ppi_score,
+        "ppi_thresh": args.ppi_thresh,
         "all_fract": args.all_fract,
         "merge": args.merge,
     }
@@ -182,64 +300,277 @@ def create_config():
     return config
 
 
+def get_stage_cache(base, config):
+    glob = config["GLOBAL"]
+    plan = stage_cache.get_plan(glob["resume_from"], glob["only"])
+    return stage_cache.StageCache(base, use=glob["stage_cache"], plan=plan)
+
+
+def run_stages(tasks, parallel=True):
+    """
+    run independent stages (functions without arguments) concurrently in
+    threads, returns when all of them are done and raises the first error
+    """
+    if not parallel or len(tasks) < 2:
+        return [x() for x in tasks]
+    # numpy error handling is per thread
+    err = np.geterr()
+
+    def task_err(task):
+        with np.errstate(**err):
+            return task()
+
+    with ThreadPoolExecutor(len(tasks)) as p:
+        res = [p.submit(task_err, x) for x in tasks]
+    return [x.result() for x in res]
+
+
 def preprocessing(infile, config):
     validate.InputTester(infile, "in").test_file()
-    map_to_database.runner(
-        infile=infile,
-        db=config["GLOBAL"]["db"],
-        is_ppi=config["PREPROCESS"]["is_ppi"],
-        use_fr=config["PREPROCESS"]["all_fract"],
-    )
-    hypothesis.runner(
-        infile=infile,
-        hypothesis=config["PREPROCESS"]["merge"],
-        use_fr=config["PREPROCESS"]["all_fract"],
-    )
+    fmt = io.tmp_format(config["GLOBAL"]["tmp_fmt"], config["GLOBAL"]["tmp_compress"])
+    smpl = os.path.basename(infile)
     #  # sample specific folder
     tmp_folder = io.file2folder(infile, prefix=config["GLOBAL"]["temp"])
-    merge.runner(base=tmp_folder, mergemode=config["PREPROCESS"]["merge"])
-    generate_features.runner(
-        tmp_folder, config["GLOBAL"]["go_obo"], config["GLOBAL"]["sp_go"]
-    )
-    predict.runner(tmp_folder)
+    cache = get_stage_cache(tmp_folder, config)
+    # tmp inputs are resolved when the stage runs, after they were written
+    tmp = lambda x: [io.tmp_file(tmp_folder, y) for y in x]
+    # .npy matrix and index of the profiles of the normalize stage
+    prof = list(io.ProfileStore(tmp_folder).get_paths())
+    go_obo, sp_go = config["GLOBAL"]["go_obo"], config["GLOBAL"]["sp_go"]
+    stores = [
+        "profiles",
+        "profiles_idx",
+        "raw_profiles",
+        "raw_profiles_idx",
+        "profiles_fr",
+    ]
+    model = io.resource_path("rf_allneg.clf")
+    stages = {
+        # profiles read and normalized once for all the other stages
+        "normalize": dict(
+            func=normalize.runner,
+            inputs=[infile],
+            outputs=stores,
+            infile=infile,
+            use_fr=config["PREPROCESS"]["all_fract"],
+        ),
+        "map_to_database": dict(
+            func=map_to_database.runner,
+            inputs=[config["GLOBAL"]["db"]] + prof,
+            outputs=["ann_cmplx"],
+            infile=infile,
+            db=config["GLOBAL"]["db"],
+            is_ppi=config["PREPROCESS"]["is_ppi"],
+            use_fr=config["PREPROCESS"]["all_fract"],
+            fmt=fmt,
+            prof_store=config["GLOBAL"]["prof_store"],
+            ppi_score=config["PREPROCESS"]["ppi_score"],
+            ppi_thresh=config["PREPROCESS"]["ppi_thresh"],
+        ),
+        "hypothesis": dict(
+            func=hypothesis.runner,
+            inputs=prof,
+            outputs=["hypo", "splitted_transf"],
+            infile=infile,
+            hypothesis=config["PREPROCESS"]["merge"],
+            use_fr=config["PREPROCESS"]["all_fract"],
+            fmt=fmt,
+            prof_store=config["GLOBAL"]["prof_store"],
+        ),
+        "merge": dict(
+            func=merge.runner,
+            inputs=lambda: tmp(["hypo", "ann_cmplx"]),
+            outputs=["cmplx_combined"],
+            base=tmp_folder,
+            mergemode=config["PREPROCESS"]["merge"],
+            fmt=fmt,
+        ),
+        "generate_features": dict(
+            func=generate_features.runner,
+            inputs=lambda: tmp(["cmplx_combined"]) + prof + [go_obo, sp_go],
+            outputs=["mp_feat_norm", "peak_list", "feat_matrix", "feat_matrix_idx"],
+            base=tmp_folder,
+            go_obo=go_obo,
+            tsp_go=sp_go,
+            fmt=fmt,
+            feat_export=config["GLOBAL"]["feat_export"],
+            workers=config["GLOBAL"]["feat_workers"],
+        ),
+        "predict": dict(
+            func=predict.runner,
+            inputs=lambda: list(io.FeatureMatrix(tmp_folder).get_paths())
+            + tmp(["mp_feat_norm"])
+            + [model],
+            outputs=["rf"],
+            base=tmp_folder,
+            model=model,
+            fmt=fmt,
+        ),
+    }
+
+    def stage_task(stage):
+        def task():
+            with perf.REPORT.stage(stage, smpl):
+                return cache.run(stage, **stages[stage])
+
+        return task
+
+    # stages of a wave only depend on the previous waves
+    parallel = config["GLOBAL"]["mult"] == "True"
+    for wave in stage_cache.waves(stage_cache.SAMPLE_STAGES):
+        run_stages([stage_task(x) for x in wave], parallel)
     return True
 
 
+def preprocess_worker(infile, config):
+    """
+    run preprocessing for a sample, errors are returned instead of raised so
+    every sample completes and failures are reported in the sample order
+    returns the traceback (None if ok) and the perf records of the sample
+    """
+    n = len(perf.REPORT.stages)
+    # sample processes may be spawned instead of forked
+    resource_cache.set_cache_dir(config["GLOBAL"]["cache_dir"])
+    try:
+        preprocessing(infile, config)
+        err = None
+    except Exception:
+        err = traceback.format_exc()
+    return err, perf.REPORT.stages[n:]
+
+
+def get_workers(config, nfiles):
+    """
+    number of processes for preprocessing, never more than the samples
+    """
+    if config["GLOBAL"]["mult"] != "True":
+        return 1
+    workers = int(config["GLOBAL"]["workers"])
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, nfiles))
+
+
+def get_feat_workers(config, workers):
+    """
+    number of feature processes per sample, by default the CPUs left over
+    by the workers sample processes
+    """
+    if config["GLOBAL"]["mult"] != "True":
+        return 1
+    feat_workers = int(config["GLOBAL"]["feat_workers"])
+    if feat_workers <= 0:
+        feat_workers = (os.cpu_count() or 1) // workers
+    return max(1, feat_workers)
+
+
 def main():
     config = create_config()
+    try:
+        run(config)
+    finally:
+        # written also for failed runs, stages have an ok flag
+        perf.REPORT.write("ProphetPerf.json")
+
+
+def run(config):
     validate.InputTester(config["GLOBAL"]["db"], "db").test_file()
     validate.InputTester(config["GLOBAL"]["sid"], "ids").test_file()
     files = io.read_sample_ids(config["GLOBAL"]["sid"])
     files = [os.path.abspath(x) for x in files.keys()]
-    if config["GLOBAL"]["mult"] == "True":
-        p = mult_proc.Pool(len(files))
-        preproc_conf = partial(preprocessing, config=config)
-        p.map(preproc_conf, files)
-        p.close()
-        p.join()
+    resource_cache.set_cache_dir(config["GLOBAL"]["cache_dir"])
+    with perf.REPORT.stage("resources"):
+        resource_cache.warm(config)
+        # clustered once here instead of once per sample
+        if config["PREPROCESS"]["is_ppi"] == "True":
+            map_to_database.ppi_db(
+                config["GLOBAL"]["db"],
+                config["PREPROCESS"]["ppi_score"],
+                config["PREPROCESS"]["ppi_thresh"],
+                workers=get_workers(config, os.cpu_count() or 1),
+            )
+    cache = get_stage_cache(config["GLOBAL"]["temp"], config)
+    if any([cache.plan[x] != "skip" for x in stage_cache.SAMPLE_STAGES]):
+        run_samples(files, config)
+    temp, outf = config["GLOBAL"]["temp"], config["GLOBAL"]["output"]
+    sid = config["GLOBAL"]["sid"]
+    folders = [io.file2folder(x, prefix=temp) for x in files]
+    with perf.REPORT.stage("collapse"):
+        cache.run(
+            "collapse",
+            collapse.runner,
+            inputs=[os.path.join(x, "stages.json") for x in folders]
+            + [sid, config["GLOBAL"]["cal"], config["GLOBAL"]["mw"]],
+            outputs=["combined", os.path.abspath("cal.txt")]
+            + [os.path.abspath(os.path.join(x, "fdr.txt")) for x in folders],
+            tmp_=temp,
+            ids=sid,
+            cal=config["GLOBAL"]["cal"],
+            mw=config["GLOBAL"]["mw"],
+            fdr=config["POSTPROCESS"]["fdr"],
+            mode=config["POSTPROCESS"]["collapse_mode"],
+            compress=config["GLOBAL"]["tmp_compress"],
+        )
+    combined_file = io.tmp_file(temp, "combined")
+    reports = [
+        "ComplexReport.txt",
+        "PPIReport.txt",
+        "DifferentialComplexReport.txt",
+        "DifferentialProteinReport.txt",
+    ]
+    with perf.REPORT.stage("differential"):
+        cache.run(
+            "differential",
+            differential.runner,
+            inputs=[combined_file, sid, "cal.txt", config["GLOBAL"]["sp_go"]],
+            outputs=["stoichiometry"]
+            + [os.path.abspath(os.path.join(outf, x)) for x in reports],
+            infile=combined_file,
+            sample=sid,
+            outf=outf,
+            temp=temp,
+            sp_go=config["GLOBAL"]["sp_go"],
+        )
+    with perf.REPORT.stage("plots"):
+        plots_out = ["FalseDiscoveryRate.pdf", "RecallDatabase.pdf"]
+        cache.run(
+            "plots",
+            plots.runner,
+            inputs=[combined_file, sid, os.path.join(outf, "ComplexReport.txt")],
+            outputs=[os.path.abspath(os.path.join(outf, x)) for x in plots_out],
+            tmp_fold=temp,
+            out_fold=outf,
+            target_fdr=config["POSTPROCESS"]["fdr"],
+            sid=sid,
+        )
+    return True
+
+
+def run_samples(files, config):
+    """
+    preprocess all samples, raise SampleError once all of them are done if
+    any failed
+    """
+    workers = get_workers(config, len(files))
+    feat_workers = get_feat_workers(config, workers)
+    config["GLOBAL"]["feat_workers"] = str(feat_workers)
+    if workers > 1:
+        preproc_conf = partial(preprocess_worker, config=config)
+        # not a multiprocessing.Pool, its daemonic processes cannot start the
+        # feature workers of a sample
+        with ProcessPoolExecutor(workers) as p:
+            res = list(p.map(preproc_conf, files))
+        [perf.REPORT.add(x) for _, stages in res for x in stages]
     else:
-        [preprocessing(infile, config) for infile in files]
-    collapse.runner(
-        config["GLOBAL"]["temp"],
-        config["GLOBAL"]["sid"],
-        config["GLOBAL"]["cal"],
-        config["GLOBAL"]["mw"],
-        config["POSTPROCESS"]["fdr"],
-        config["POSTPROCESS"]["collapse_mode"],
-    )
-    combined_file = os.path.join(config["GLOBAL"]["temp"], "combined.txt")
-    differential.runner(
-        combined_file,
-        config["GLOBAL"]["sid"],
-        config["GLOBAL"]["output"],
-        config["GLOBAL"]["temp"],
-    )
-    plots.runner(
-        config["GLOBAL"]["temp"],
-        config["GLOBAL"]["output"],
-        config["POSTPROCESS"]["fdr"],
-        config["GLOBAL"]["sid"],
-    )
+        res = [preprocess_worker(infile, config) for infile in files]
+    failed = []
+    for infile, (err, _) in zip(files, res):
+        if err:
+            print("Preprocessing failed for {}\n{}".format(infile, err))
+            failed.append(os.path.basename(infile))
+    if failed:
+        raise SampleError(", ".join(failed))
+    return True
 
 
 if __name__ == "__main__":
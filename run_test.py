@@ -1,15 +1,28 @@
 # !/usr/bin/env python3
 
+import multiprocessing
 import os
+import threading
+import numpy as np
+import pandas as pd
 from PCprophet import io_ as io
 from PCprophet import collapse as collapse
 from PCprophet import generate_features as generate_features
 from PCprophet import hypothesis as hypothesis
 from PCprophet import map_to_database as map_to_database
+from PCprophet import mcl as mcl
 from PCprophet import merge as merge
+from PCprophet import normalize as normalize
+from PCprophet import perf as perf
 from PCprophet import predict as predict
+from PCprophet import resource_cache as resource_cache
+from PCprophet import stage_cache as stage_cache
+from PCprophet import stats_ as stats_
 import main
 
+# keep the resource cache of the tests out of the package folder
+os.environ[resource_cache.CACHE_ENV] = os.path.abspath(os.path.join("tmp", "cache"))
+
 
 def get_conf_files():
     test_ids = os.path.join('test', 'test_ids.txt')
@@ -22,6 +35,26 @@ def get_conf_files():
     return [conf, files[0], tmp_f]
 
 
+def test_normalize():
+    conf, fl, tmp_f = get_conf_files()
+    fin = normalize.runner(infile=fl, use_fr=conf["PREPROCESS"]["all_fract"])
+    norm, raw = normalize.get_stores(tmp_f)
+    if not fin or norm.load().mat.shape[1] != 72 or raw.load().mat.shape[1] != 72:
+        assert False
+
+
+def test_normalize_fr():
+    conf, fl, tmp_f = get_conf_files()
+    full, _ = normalize.load(fl, "all")
+    full = full.to_dict()
+    part, _ = normalize.load(fl, "10")
+    # stores of another -a are normalized again
+    if normalize.read_fr(tmp_f) != "10" or part.to_dict() == full:
+        assert False
+    if normalize.load(fl, "all")[0].to_dict() != full:
+        assert False
+
+
 def test_database():
     conf, fl, tmp_f = get_conf_files()
     fin = map_to_database.runner(
@@ -80,3 +113,464 @@ def test_collapse():
     )
     if not fin:
         assert False
+
+
+def test_npz_tables():
+    conf, fl, tmp_f = get_conf_files()
+    ann = io.read_table(io.tmp_file(tmp_f, "ann_cmplx", "txt"))
+    ann["FT"] = io.to_cells([io.parse_profiles(x) for x in ann["FT"]])
+    dest = io.tmp_file(tmp_f, "ann_cmplx_test", "npz")
+    io.write_table(ann, dest)
+    ann_npz = io.read_table(dest)
+    os.remove(dest)
+    if list(ann_npz.columns) != list(ann.columns):
+        assert False
+    for arr, arr_npz in zip(ann["FT"], ann_npz["FT"]):
+        if not (arr == arr_npz).all():
+            assert False
+    # long member lists do not pad the other rows, same size as the text
+    rng = np.random.RandomState(0)
+    mb = [
+        "#".join(["P{:05d}".format(x) for x in range(rng.randint(2, 100))])
+        for _ in range(500)
+    ]
+    df = pd.DataFrame({"ID": ["c{}".format(x) for x in range(500)], "MB": mb, "N": 1})
+    txt, npz = [io.tmp_file(tmp_f, "str_test", x) for x in ["txt", "npz"]]
+    io.write_table(df, txt)
+    io.write_table(df, npz)
+    sizes = [os.path.getsize(x) for x in [txt, npz]]
+    df_npz = io.read_table(npz)
+    [os.remove(x) for x in [txt, npz]]
+    if sizes[1] > 1.1 * sizes[0] or not df_npz.equals(df):
+        assert False
+
+
+def test_read_txt():
+    conf, fl, tmp_f = get_conf_files()
+    prot = io.read_txt(fl)
+    ncol = len(open(fl).readline().split("\t")) - 2
+    if not all([len(x) == ncol for x in prot.values()]):
+        assert False
+
+
+def test_profile_store():
+    conf, fl, tmp_f = get_conf_files()
+    prot = io.read_txt(fl)
+    store = io.ProfileStore(tmp_f, "profiles_test").write(prot)
+    for k in prot:
+        if list(store.get(k)) != prot[k]:
+            assert False
+    [os.remove(x) for x in store.get_paths()]
+
+
+def test_batch_writer():
+    conf, fl, tmp_f = get_conf_files()
+    rows = ["\t".join([str(x), str(x * 2)]) for x in range(25)]
+    for comp, dest in [(None, "batch_test.txt"), ("gzip", "batch_test.txt.gz")]:
+        dest = os.path.join(tmp_f, dest)
+        with io.BatchWriter(dest, ["A", "B"], size=10, compress=comp) as out:
+            out.dump_all(rows)
+        with io.open_file(dest, "r", comp) as infile:
+            lines = infile.read().splitlines()
+        os.remove(dest)
+        if lines != ["A\tB"] + rows:
+            assert False
+
+
+def test_compressed_tables():
+    conf, fl, tmp_f = get_conf_files()
+    kw = {"index_col": "ID", "float_precision": "round_trip"}
+    raw = io.read_table(io.tmp_file(tmp_f, "hypo", "txt"), **kw)
+    dest = io.tmp_file(tmp_f, "hypo_test", io.tmp_format("txt", "gzip"))
+    io.write_table(raw, dest, index=True)
+    if io.detect_compression(dest) != "gzip":
+        assert False
+    raw_gz = io.read_table(dest, **kw)
+    os.remove(dest)
+    if not raw.equals(raw_gz):
+        assert False
+
+
+def test_resource_cache():
+    path = io.resource_path("go_terms_class.txt")
+    go = resource_cache.table(path)
+    key = resource_cache.cache_key(path, "tab")
+    if not os.path.isfile(os.path.join(resource_cache.cache_dir(), key + ".pkl")):
+        assert False
+    resource_cache._LOADED.clear()
+    go_disk = resource_cache.table(path)
+    if go_disk is go or not go_disk.equals(go):
+        assert False
+    if resource_cache.table(path) is not go_disk:
+        assert False
+    # pickles of another cache version are not reused
+    resource_cache.CACHE_VERSION += 1
+    try:
+        if resource_cache.cache_key(path, "tab") == key:
+            assert False
+    finally:
+        resource_cache.CACHE_VERSION -= 1
+    if not resource_cache.cache_dir().startswith(os.path.abspath("tmp")):
+        assert False
+
+
+def test_explode_members():
+    df = pd.DataFrame(
+        {"ID": ["a", "b", "a"], "MB": ["X#Y", "Y#Z#W", "X#Y"], "P": [1.0, 2.0, 3.0]}
+    )
+    old = df.copy()
+    old["MB"] = old["MB"].str.split("#")
+    old = io.explode(df=old, lst_cols=["MB"])[df.columns]
+    new = io.explode_members(df, "MB").astype({"ID": object, "MB": object})
+    if not old.equals(new):
+        assert False
+
+
+def test_feat_matrix():
+    conf, fl, tmp_f = get_conf_files()
+    X = np.arange(12, dtype=float).reshape(3, 4) / 7
+    feat = io.FeatureMatrix(tmp_f, "feat_matrix_test").write_rows(["a", "b", "c"], X)
+    paths = feat.get_paths()
+    if feat.mat.dtype != np.float32 or feat.names != ["a", "b", "c"]:
+        assert False
+    if not (feat.mat == X.astype(np.float32)).all():
+        assert False
+    [os.remove(x) for x in paths]
+
+
+def test_perf_report():
+    report = perf.PerfReport()
+    with report.stage("stage_test", "smpl"):
+        perf.count(proteins_in=3)
+        perf.count(proteins_in=2, complexes_out=1)
+    if perf.count(proteins_in=1):
+        assert False
+    rec = report.stages[0]
+    if rec["rows"] != {"proteins_in": 5, "complexes_out": 1} or not rec["ok"]:
+        assert False
+    if report.summary()["stage_test"]["n"] != 1:
+        assert False
+    # cpu of a worker process is reported with the stage it ended in
+    with report.stage("stage_pool", "smpl"):
+        proc = multiprocessing.Process(target=sum, args=(range(10**7),))
+        proc.start()
+        proc.join()
+    rec = report.stages[1]
+    if rec["children_cpu_s"] <= 0:
+        assert False
+    # cpu of threads started by the stage and memory peak of the stage only
+    with report.stage("stage_big", "smpl"):
+        big = np.ones(2**25)
+        thread = threading.Thread(target=sum, args=(range(10**7),))
+        thread.start()
+        thread.join()
+        del big
+    with report.stage("stage_small", "smpl"):
+        pass
+    big, small = report.stages[2:]
+    if big["cpu_scope"] != "process" or big["cpu_s"] < 0.05:
+        assert False
+    if perf.current_rss() and big["peak_rss_mb"] - small["peak_rss_mb"] < 200:
+        assert False
+
+
+def test_stage_cache():
+    conf, fl, tmp_f = get_conf_files()
+    calls = []
+
+    def stage(dest, val):
+        calls.append(val)
+        with open(dest, "w") as outfile:
+            outfile.write(val)
+        return True
+
+    dest = os.path.join(tmp_f, "stage_test.txt")
+    for val in ["a", "a", "b"]:
+        cache = stage_cache.StageCache(tmp_f, name="stages_test.json")
+        cache.run("test", stage, [fl], ["stage_test"], dest=dest, val=val)
+    # output modified outside of the stage
+    with open(dest, "w") as outfile:
+        outfile.write("c")
+    cache = stage_cache.StageCache(tmp_f, name="stages_test.json")
+    cache.run("test", stage, [fl], ["stage_test"], dest=dest, val="b")
+    [os.remove(x) for x in [dest, cache.path]]
+    if calls != ["a", "b", "b"]:
+        assert False
+
+
+def test_workers():
+    conf, fl, tmp_f = get_conf_files()
+    conf["GLOBAL"]["workers"] = "4"
+    if main.get_workers(conf, 2) != 2 or main.get_workers(conf, 8) != 4:
+        assert False
+    conf["GLOBAL"]["feat_workers"] = "3"
+    if main.get_feat_workers(conf, 2) != 3:
+        assert False
+    err, stages = main.preprocess_worker("missing_sample.txt", conf)
+    if err is None or stages:
+        assert False
+
+
+def test_stage_plan():
+    plan = stage_cache.get_plan(resume_from="merge")
+    skip = [x for x in stage_cache.STAGES if plan[x] == "skip"]
+    if skip != ["normalize", "map_to_database", "hypothesis"]:
+        assert False
+    plan = stage_cache.get_plan(only="plots")
+    if [x for x in stage_cache.STAGES if plan[x] != "skip"] != ["plots"]:
+        assert False
+    waves = stage_cache.waves(stage_cache.SAMPLE_STAGES)
+    if waves[1] != ["map_to_database", "hypothesis"] or len(waves) != 5:
+        assert False
+
+
+def test_norm_profiles():
+    rng = np.random.RandomState(0)
+    mat = rng.rand(20, 30) * (rng.rand(20, 30) > 0.3)
+    mat[3] = 0
+    keep, norm = stats_.norm_profiles(mat, stretch=(True, 72))
+    if keep[3] or norm.shape != (19, 72):
+        assert False
+    for row, ref in zip(norm, mat[keep]):
+        ref = stats_.impute_namean(stats_.gauss_filter(ref))
+        ref = stats_.resize(stats_.resample(ref, len(ref), output_fr=72))
+        if not np.allclose(row, ref, rtol=0, atol=1e-12):
+            assert False
+
+
+def test_derived_cache():
+    src = os.path.join("test", "derived_test.txt")
+    with open(src, "w") as outfile:
+        outfile.write("protA\tprotB\nA\tB\n")
+    calls = []
+
+    def writer(path, dest):
+        calls.append(path)
+        with open(path) as infile, open(dest, "w") as outfile:
+            outfile.write(infile.read().upper())
+
+    db = resource_cache.derived(src, "derived_test", writer)
+    if resource_cache.derived(src, "derived_test", writer) != db or len(calls) != 1:
+        assert False
+    with open(src, "a") as outfile:
+        outfile.write("C\tD\n")
+    db2 = resource_cache.derived(src, "derived_test", writer)
+    os.remove(src)
+    if db2 == db or len(calls) != 2 or open(db2).read() != "PROTA\tPROTB\nA\tB\nC\tD\n":
+        assert False
+    [os.remove(x) for x in [db, db2]]
+    # not writable cache, computed in a folder of the run
+    with open(src, "w") as outfile:
+        outfile.write("A\tB\n")
+    resource_cache.set_cache_dir(src)
+    try:
+        db3 = resource_cache.derived(src, "derived_test", writer)
+    finally:
+        resource_cache.set_cache_dir("None")
+    os.remove(src)
+    if not db3.startswith(resource_cache.run_dir()) or open(db3).read() != "A\tB\n":
+        assert False
+
+
+def test_ppi2csr():
+    ppi = os.path.join("test", "ppi_test.txt")
+    edges = ["A\tB\t900", "A\tC\t300", "B\tA\t700", "C\tD\t800"]
+    with open(ppi, "w") as outfile:
+        outfile.write("\n".join(["protA\tprotB\tscore"] + edges) + "\n")
+    mat, names = io.ppi2csr(ppi)
+    mat_sc, names_sc = io.ppi2csr(ppi, score="score", thresh=500, chunksize=2)
+    os.remove(ppi)
+    if names != ["A", "B", "C", "D"] or mat.nnz != 6 or (mat != mat.T).nnz:
+        assert False
+    if names_sc != ["A", "B", "C", "D"] or mat_sc.nnz != 4 or mat_sc[0, 1] != 900:
+        assert False
+
+
+def test_mcl_sparse():
+    rng = np.random.RandomState(0)
+    dense = (rng.rand(60, 60) > 0.9).astype(float)
+    dense = np.maximum(dense, dense.T)
+    sparse = mcl.csc_matrix(dense)
+    if mcl.get_clusters(mcl.run_mcl(sparse)) != mcl.get_clusters(mcl.run_mcl(dense)):
+        assert False
+    pruned = mcl.prune(mcl.normalize(sparse), 0.2, topk=2).toarray()
+    if ((pruned > 0).sum(axis=0) > 2).any() or (pruned.max(axis=0) == 0).any():
+        assert False
+
+
+def test_mcl_blocks():
+    rng = np.random.RandomState(1)
+    dense = (rng.rand(80, 80) > 0.92).astype(float)
+    sparse = mcl.csc_matrix(np.maximum(dense, dense.T))
+    clusters = mcl.get_clusters(mcl.run_mcl(sparse))
+    if mcl.get_clusters(mcl.run_mcl(sparse, workers=3, block_size=7)) != clusters:
+        assert False
+    if mcl.get_clusters(mcl.run_mcl(sparse, block_size=1000)) != clusters:
+        assert False
+
+
+def test_modularity():
+    # two triangles joined by one edge
+    adj = np.zeros((6, 6))
+    for i, j in [(0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5), (2, 3)]:
+        adj[i, j] = adj[j, i] = 1
+    deg = 2 * adj.sum(axis=0)
+    for clusters in [[(0, 1, 2), (3, 4, 5)], [(0, 1, 2, 3), (3, 4, 5)]]:
+        same = np.zeros((6, 6), dtype=bool)
+        for c in clusters:
+            same[np.ix_(c, c)] = True
+        np.fill_diagonal(same, False)
+        exp = (adj - np.outer(deg, deg) / adj.sum())[same].sum() / adj.sum()
+        for mat in [adj, mcl.csr_matrix(adj)]:
+            if not np.isclose(mcl.modularity(mat, clusters), exp):
+                assert False
+
+
+def test_mcl_freeze():
+    rng = np.random.RandomState(2)
+    dense = (rng.rand(80, 80) > 0.92).astype(float)
+    sparse = mcl.csc_matrix(np.maximum(dense, dense.T))
+    clusters = mcl.get_clusters(mcl.run_mcl(sparse))
+    if mcl.get_clusters(mcl.run_mcl(sparse, freeze=True)) != clusters:
+        assert False
+    if mcl.get_clusters(mcl.run_mcl(sparse, freeze=True, block_size=9)) != clusters:
+        assert False
+
+
+def test_optimize_mcl():
+    sweep = {2.5: ([], 0.5), 1.5: ([], -0.1), 2.0: ([], 0.5), 1.8: ([], 0.2)}
+    if map_to_database.optimize_mcl(sweep) != 2.0:
+        assert False
+
+
+def test_complex_index():
+    src = os.path.join("test", "index_test.txt")
+    with open(src, "w") as outfile:
+        outfile.write("ComplexID\tComplexName\tsubunits(Gene name)\n")
+        outfile.write('1\t"c1"\ta;B;c\n2\tc2\tB;d\n3\tc3\tA;E;e;F\n')
+    index = io.read_complex_db(src)
+    os.remove(src)
+    rows, cmplt, memb = index.select(["A", "B", "E"])
+    if list(rows) != [0, 2] or memb != [["A", "B"], ["A", "E", "E"]]:
+        assert False
+    if not np.allclose(cmplt, [2 / 3, 3 / 4]) or index.names[0] != "c1_1":
+        assert False
+    if list(index.complexes("B")) != [0, 1] or len(index.complexes("X")):
+        assert False
+
+
+def test_decondense():
+    rng = np.random.RandomState(3)
+    ids = ["P{}".format(x) for x in range(40)]
+    df = pd.DataFrame(rng.rand(40, 10), index=ids)
+    rows = hypothesis.cluster.hierarchy.linkage(df)
+    order, start, stop = hypothesis.leaf_ranges(rows)
+    if list(order) != list(hypothesis.cluster.hierarchy.leaves_list(rows)):
+        assert False
+    clusters = list(hypothesis.decondense(df, ids, max_size=10))
+    if not clusters or any([len(x) < 2 or len(x) > 10 for x in clusters]):
+        assert False
+    # the root holds every profile
+    if sorted(list(hypothesis.decondense(df, ids, max_size=40))[-1]) != sorted(ids):
+        assert False
+
+
+def run_pipeline(**glob):
+    """
+    whole run on the test sample with the small GO fixtures
+    scoring in this process (-mult False), no FDR control
+    """
+    conf, fl, tmp_f = get_conf_files()
+    conf["GLOBAL"].update(
+        {
+            "go_obo": os.path.abspath(os.path.join("test", "test_go.obo")),
+            "sp_go": os.path.abspath(os.path.join("test", "test_gaf.txt")),
+            "output": os.path.join("tmp", "test_out"),
+            "mult": "False",
+            "stage_cache": "False",
+        }
+    )
+    conf["GLOBAL"].update(glob)
+    conf["POSTPROCESS"]["fdr"] = "0"
+    main.run(conf)
+    return conf
+
+
+def test_features_differential():
+    # genes missing from the gaf are scored before the complex report
+    conf = run_pipeline()
+    report = os.path.join(conf["GLOBAL"]["output"], "ComplexReport.txt")
+    if not os.path.isfile(report):
+        assert False
+    # lookups of the shared gaf must not add genes to it
+    gaf = resource_cache.gaf(conf["GLOBAL"]["sp_go"])
+    if set(gaf) != set(io.read_tab(conf["GLOBAL"]["sp_go"])["GN"].str.upper()):
+        assert False
+
+
+def test_compressed_differential():
+    conf = run_pipeline(tmp_compress="gzip")
+    combined = io.tmp_file(conf["GLOBAL"]["temp"], "combined")
+    if not combined.endswith(".gz"):
+        assert False
+    # differential reads the compressed combined file
+    report = os.path.join(conf["GLOBAL"]["output"], "ComplexReport.txt")
+    if not os.path.isfile(report):
+        assert False
+
+
+def test_zstd_option():
+    argv, zstd = main.sys.argv, io.zstandard
+    main.sys.argv, io.zstandard = ["main.py", "-tmp_compress", "zstd"], None
+    try:
+        main.create_config()
+        assert False
+    except SystemExit:
+        pass
+    finally:
+        main.sys.argv, io.zstandard = argv, zstd
+
+
+def test_ppi_thresh_option():
+    argv = main.sys.argv
+    main.sys.argv = ["main.py", "-is_ppi", "True", "-ppi_thresh", "400"]
+    try:
+        main.create_config()
+        assert False
+    except SystemExit:
+        pass
+    finally:
+        main.sys.argv = argv
+
+
+def test_sweep_threads():
+    # a single missing inflation gets all the workers as threads
+    ppi = os.path.join("test", "sweep_test.txt")
+    with open(ppi, "w") as outfile:
+        outfile.write("protA\tprotB\nA\tB\nB\tC\nA\tC\nC\tD\nD\tE\nE\tF\nD\tF\n")
+    mat, names = io.ppi2csr(ppi)
+    grid, run_mcl = map_to_database.MCL_PARAMS["inflation"], mcl.run_mcl
+    calls = []
+
+    def run(*args, **kwargs):
+        calls.append(kwargs["workers"])
+        return run_mcl(*args, **kwargs)
+
+    map_to_database.MCL_PARAMS["inflation"], mcl.run_mcl = [2.0], run
+    try:
+        sweep = map_to_database.sweep_mcl(ppi, mat, workers=4)
+    finally:
+        map_to_database.MCL_PARAMS["inflation"], mcl.run_mcl = grid, run_mcl
+        os.remove(ppi)
+    if calls != [4] or list(sweep) != [2.0] or not sweep[2.0][0]:
+        assert False
+
+
+def test_stage_cache_npz():
+    # keys of a first npz run are built from the files written by the run
+    run_pipeline(tmp_fmt="npz", stage_cache="True")
+    n = len(perf.REPORT.stages)
+    run_pipeline(tmp_fmt="npz", stage_cache="True")
+    recs = [x for x in perf.REPORT.stages[n:] if x["stage"] in stage_cache.STAGES]
+    if not all([x["rows"].get("cached") for x in recs]):
+        assert False